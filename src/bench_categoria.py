@@ -0,0 +1,415 @@
+""" Confronta info_categoria(), check_master() e info_ostacoli() con le
+versioni a un re.search() per pattern che c'erano prima, su tutti i nomi di
+merged_links.csv: prima controlla che diano gli stessi risultati, poi misura
+i tempi. Controlla anche che classifica_eventi(), quella che scrive in
+pagine_gara, dia per ogni riga lo stesso risultato di
+assegna_evento_generale() + assegna_evento_specifico() chiamate sul nome
+originale. Da lanciare dalla cartella principale del repository. """
+import re
+import sys
+import time
+import contextlib
+import io
+import pandas as pd
+from func_general import (check_master, info_categoria, info_ostacoli, classifica_eventi,
+                          assegna_evento_generale, assegna_evento_specifico)
+
+FILE_NOMI = 'merged_links.csv'
+RIPETIZIONI = 3
+
+
+## Versioni vecchie, copiate così com'erano
+
+def check_master_vecchio(nome):
+    """ Mi fido del me stesso di qualche anno fa, non ho intenzione di
+    controllare quesa funzione """
+    ## Controlla se l'evento viene taggato come evento master, utilizzato nel caso non siano state trovate altre informazioni
+    ## su altezze di ostacoli, massse di pesi/giavellotti/dischi/martelli, distanze
+    ## restituisce True o False
+    
+    nome = nome.lower()
+    
+    match_master0 = re.search(r'master', nome)
+    match_master1 = re.search(r's\d{2}', nome.replace(' ',''))
+    match_master2 = re.search(r'm\d{2}', nome.replace(' ',''))     # M70+
+    match_master3 = re.search(r'sm\d{2}', nome.replace(' ',''))    # SM45
+    match_master4 = re.search(r'f\d{2}', nome.replace(' ',''))     # F90
+    match_master5 = re.search(r'sf\d{2}', nome.replace(' ',''))    # SF50
+    
+    if match_master0 or match_master1 or match_master2 or match_master3 or match_master4 or match_master5:
+        return True
+    else:
+        return False
+
+
+def info_categoria_vecchio(nome):
+    """ Mi fido del me stesso di qualche anno fa, non ho intenzione di
+    controllare quesa funzione """
+    ## funzione scritta per inferire la categoria di un evento.
+    ## DA USARE CON ATTENZIONE
+    ## TENERE L'INPUT ORIGINALE CON SPAZI TRA PAROLE
+    ## il print di warning avviene solose trova due categorie diverse non senior/promesse
+    ## restituisce E, R, CF, CM, AF, AM, JM, AF, AM oppure una stringa vuota
+    ## genere per esordienti e ragazzi non è rilevanti.
+    ## junior e promesse donne hanno le stesse gare delle assolute
+    
+    nome = nome.strip().lower()
+    cat = ''
+    check = 0
+    
+    # Assoluti
+    match_hs_ass0 = re.search(r'\badulti u\b', nome)   # adulti u
+    match_hs_ass1 = re.search(r'uomini', nome)         # uomini
+    match_hs_ass2 = re.search(r'men', nome)            # men
+    match_hs_ass3 = re.search(r'maschile', nome)       # maschile
+    match_hs_ass4 = re.search(r'\bm\b', nome)          # m
+    match_hs_ass5 = re.search(r'\bu\b', nome)          # u
+    match_hs_ass6 = re.search(r'\bpromesse u\b', nome) # promesse u
+    match_hs_ass7 = re.search(r'\bpromesse m\b', nome) # promesse m
+    match_hs_ass8 = re.search(r'\bpm\b', nome)         # pm
+    
+    
+    match_hs_ass9 = re.search(r'donne', nome)          # donne
+    match_hs_ass10 = re.search(r'women', nome)         # women
+    match_hs_ass11 = re.search(r'femminile', nome)     # femminile
+    match_hs_ass12= re.search(r'\bf\b', nome)          # f
+    match_hs_ass13 = re.search(r'\bd\b', nome)         # d
+    match_hs_ass14 = re.search(r'\badulti d\b', nome)  # adulti d
+    match_hs_ass15 = re.search(r'\bpromesse d\b', nome) # promesse d
+    match_hs_ass16 = re.search(r'\bpromesse f\b', nome) # promesse f
+    match_hs_ass17 = re.search(r'\bpf\b', nome)         # pf
+    
+    
+    if match_hs_ass0 or match_hs_ass1 or match_hs_ass2 or match_hs_ass3 or match_hs_ass4 or match_hs_ass5 or match_hs_ass6 or match_hs_ass7 or match_hs_ass8:
+        cat = 'SM'
+    
+    if match_hs_ass9 or match_hs_ass10 or match_hs_ass11 or match_hs_ass12 or match_hs_ass13 or match_hs_ass14 or match_hs_ass15 or match_hs_ass16 or match_hs_ass17:
+        cat = 'SF'
+    
+    # Esordienti
+    match_eso1 = re.search(r'\besordienti\b', nome) # esordienti
+    match_eso2 = re.search(r'\bef\d+', nome)        # EF8
+    match_eso3 = re.search(r'\bem\d+', nome)        # EM5
+    match_eso4 = re.search(r'\bef\b', nome)         # EF
+    match_eso5 = re.search(r'\bef\b', nome)         # EM
+    
+    if match_eso1 or match_eso2 or match_eso3 or match_eso4 or match_eso5:
+        check += 1
+        cat = 'E'
+
+    # Ragazzi
+    match_hs_r0 = re.search(r'\bragazz', nome)   # ragazz
+    match_hs_r1 = re.search(r'\brm\b', nome)   # rm
+    match_hs_r2 = re.search(r'\brf\b', nome)   # rf
+    
+    if match_hs_r0 or match_hs_r1 or match_hs_r2:
+        cat = 'R'
+        check += 1
+    
+    # Cadetti
+    match_hs_c1 = re.search(r'cadetti', nome)  # cadetti
+    match_hs_c2 = re.search(r'\bcm\b', nome)   # cm
+    match_hs_c3 = re.search(r'cadette', nome)  # cadettte
+    match_hs_c4 = re.search(r'\bcf\b', nome)   # cf
+    
+    if match_hs_c1 or match_hs_c2:
+        cat = 'CM'
+        check += 1
+
+    if match_hs_c3 or match_hs_c4:
+        cat = 'CF'
+        check += 1
+    
+    # Allievi
+    match_hs_a1 = re.search(r'allievi', nome)  # allievi
+    match_hs_a2 = re.search(r'\bam\b', nome)   # am
+    match_hs_a3 = re.search(r'allieve', nome)  # allieve
+    match_hs_a4 = re.search(r'\baf\b', nome)   # af
+    
+    if match_hs_a1 or match_hs_a2:
+        cat = 'AM'
+        check += 1
+
+    if match_hs_a3 or match_hs_a4:
+        cat = 'AF'
+        check += 1
+    
+    # Junior
+    match_hs_j1 = re.search(r'junior u', nome)     # junior u
+    match_hs_j2 = re.search(r'junior m', nome)     # junior m
+    match_hs_j3 = re.search(r'juniores u', nome)   # juniores u
+    match_hs_j4 = re.search(r'juniores m', nome)   # juniores m
+    match_hs_j5 = re.search(r'\bjm\b', nome)       # jm
+    match_hs_j6 = re.search(r'junior d', nome)     # junior d
+    match_hs_j7 = re.search(r'junior f', nome)     # junior f
+    match_hs_j8 = re.search(r'juniores d', nome)   # juniores d
+    match_hs_j9 = re.search(r'juniores f', nome)   # juniores f
+    match_hs_j10 = re.search(r'\bjf\b', nome)      # jf
+    
+    if match_hs_j1 or match_hs_j2 or match_hs_j3 or match_hs_j4 or match_hs_j5:
+        cat = 'JF'
+        check += 1
+    
+    if match_hs_j6 or match_hs_j7 or match_hs_j8 or match_hs_j9 or match_hs_j10:
+        cat = 'JM'
+        check += 1
+    
+    if check > 1:
+        print('Ho trovato '+str(check)+'categorie diverse. Restituisco la più giovane. Non fidarti di me!')
+    
+    return cat
+
+
+def info_ostacoli_vecchio(nome):
+    """ Mi fido del me stesso di qualche anno fa, non ho intenzione di
+    controllare quesa funzione """
+    ## gli ostacoli sono così incasinati che ho dovuto fare una funzione a parte
+    
+    nome = nome.lower().replace('finale','').strip().replace('ostacoli', 'hs')
+    spec = ''
+    warn_spec = ''
+    found = False
+
+    #Se non comincia con un numero, faccio solo un guess su quale potrebbe essere la distanza della gara
+    if nome[0].isdigit() is False:        
+        match_dist = re.search(r'\d+', nome)
+        if match_dist:
+            dist = match_dist[0].strip()
+            spec = dist+' Hs'
+            warn_spec = 'Distanza a caso'
+        else:
+            spec = 'ostacoli'
+            warn_spec = 'Non conosco la distanza'
+        return spec, warn_spec
+
+    # D'ora in poi possiamo assumere che 'nome' cominci con un numero
+
+    # esordienti
+    match_eso1 = re.search(r'esordienti', nome)     # esordienti
+    match_eso2 = re.search(r'\bef\d+', nome)        # EF8
+    match_eso3 = re.search(r'\bem\d+', nome)        # EM5
+    match_eso4 = re.search(r'\bef\b', nome)         # EF
+    match_eso5 = re.search(r'\bem\b', nome)         # EM
+    match_eso6 = re.search(r'\bef\w\b', nome)       # EFA
+    match_eso7 = re.search(r'\bem\w\b', nome)       # EMB
+    
+    if not(found) and (match_eso1 or match_eso2 or match_eso3 or match_eso4 or match_eso5 or match_eso6 or match_eso7):
+        dist = re.search(r'\d+', nome)[0]
+        spec = dist.strip()+' Hs Esordienti'
+        found = True
+    
+    # master
+    if not(found) and check_master_vecchio(nome):
+        spec = re.search(r'\d+', nome)[0].strip()+' Hs Master'
+        found = True
+        
+    # togliamoci dai piedi quelli scritti bene
+    pat_hs0 = r'\d+hsh\d+-\d.\d{2}' # 60hsh106-9.14
+    match_hs0 = re.search(pat_hs0, nome.replace(' ',''))
+    
+    if not(found) and match_hs0:
+        spec = match_hs0[0].strip().split('h')[0]+' Hs h'+match_hs0[0].strip().split('h')[2][:-5]
+        found = True
+    
+    # passiamo a quelli scritti senza distanza
+    match_hs1 = re.search(r'h\d+', nome.replace(' ',''))      # h100
+    
+    if not(found) and match_hs1:
+        dist = re.search(r'\d+[^\d]*hs', nome.replace(' ', ''), re.IGNORECASE)[0]  # match full "number-junk-hs"
+        dist = re.search(r'\d+', dist)[0]  # extract only the number
+        h = match_hs1[0].strip().split('h')[-1]
+        
+        spec = dist+' Hs h'+h
+        found = True
+    
+    # ora devo indentificare le categorie se voglio sapere l'altezza dell'ostacolo
+    # ragazzi
+    dist = re.search(r'\d+', nome)[0].strip()
+    match_hs_r0 = re.search(r'ragazz', nome)   # ragazz
+    match_hs_r1 = re.search(r'\brm\b', nome)   # rm
+    match_hs_r2 = re.search(r'\brf\b', nome)   # rf
+    
+    if not(found) and (match_hs_r0 or match_hs_r1 or match_hs_r2):
+        spec = dist+' Hs h60'
+        found = True
+        
+    # cadetti e cadette
+    match_hs_c1 = re.search(r'cadetti', nome)  # cadetti
+    match_hs_c2 = re.search(r'\bcm\b', nome)   # cm
+    match_hs_c3 = re.search(r'cadette', nome)  # cadettte
+    match_hs_c4 = re.search(r'\bcf\b', nome)   # cf
+    
+    if not(found) and (match_hs_c1 or match_hs_c2):
+        if dist in ('60', '100'): h = '84'
+        elif dist in ('200', '300'): h = '76'
+        else:
+            warn_spec = 'distanza strana'
+            h = ''
+        spec = dist+' Hs h'+h
+        found = True
+
+    if not(found) and (match_hs_c3 or match_hs_c4):
+        spec = dist+' Hs h76'
+        found = True
+        
+    # allievi e allieve
+    match_hs_a1 = re.search(r'allievi', nome)  # allievi
+    match_hs_a2 = re.search(r'\bam\b', nome)   # am
+    match_hs_a3 = re.search(r'allieve', nome)  # allieve
+    match_hs_a4 = re.search(r'\baf\b', nome)   # af
+    
+    if not(found) and (match_hs_a1 or match_hs_a2):
+        if dist in ('60', '100'): h = '91'
+        elif dist == '200': h = '76'
+        elif dist == ('300', '400'): h = '84'
+        else:
+            warn_spec = 'distanza strana'
+            h = ''
+        spec = dist+' Hs h'+h
+        found = True
+
+    if not(found) and (match_hs_a3 or match_hs_a4):
+        spec = dist+' Hs h76'
+        found = True
+        
+    # junior
+    match_hs_j1 = re.search(r'junior u', nome)     # junior u
+    match_hs_j2 = re.search(r'junior m', nome)     # junior m
+    match_hs_j3 = re.search(r'juniores u', nome)   # juniores u
+    match_hs_j4 = re.search(r'juniores m', nome)   # juniores m
+    match_hs_j5 = re.search(r'\bjm\b', nome)       # jm
+    match_hs_j6 = re.search(r'junior d', nome)     # junior d
+    match_hs_j7 = re.search(r'junior f', nome)     # junior f
+    match_hs_j8 = re.search(r'juniores d', nome)   # juniores d
+    match_hs_j9 = re.search(r'juniores f', nome)   # juniores f
+    match_hs_j10 = re.search(r'\bjf\b', nome)      # jf
+    
+    if not(found) and (match_hs_j1 or match_hs_j2 or match_hs_j3 or match_hs_j4 or match_hs_j5):
+        if dist in ('60', '110'): h = '100'
+        elif dist == '200': h = '76'
+        elif dist == ('300', '400'): h = '91'
+        else:
+            warn_spec = 'distanza strana'
+            h = ''
+        spec = dist+' Hs h'+h
+        found = True
+    
+    if not(found) and (match_hs_j6 or match_hs_j7 or match_hs_j8 or match_hs_j9 or match_hs_j10):
+        if dist in ('60', '100'): h = '84'
+        elif dist == '200': h = '76'
+        elif dist == ('300', '400'): h = '76'
+        else:
+            warn_spec = 'distanza strana'
+            h = ''
+        spec = dist+' Hs h'+h
+        found = True
+    
+    # In teoria mi sono rimasti solo gli assoluti ora. Devo solo distinguere tra uomo e donna
+    match_hs_ass1 = re.search(r'uomini', nome)     # uomini
+    match_hs_ass2 = re.search(r'men', nome)        # men
+    match_hs_ass3 = re.search(r'maschil\w', nome)   # maschile
+    match_hs_ass4 = re.search(r'\bm\b', nome)      # m
+    match_hs_ass5 = re.search(r'\bu\b', nome)      # u
+    match_hs_ass6 = re.search(r'donne', nome)      # donne
+    match_hs_ass7 = re.search(r'women', nome)      # women
+    match_hs_ass8 = re.search(r'femminil\w', nome)  # maschile
+    match_hs_ass9 = re.search(r'\bf\b', nome)      # f
+    match_hs_ass10 = re.search(r'\bd\b', nome)     # d
+    
+    if not(found) and (match_hs_ass1 or match_hs_ass2 or match_hs_ass3 or match_hs_ass4 or match_hs_ass5):
+        if dist in ('60', '110'): h = '106'
+        elif dist == '200': h = '76'
+        elif dist == ('300', '400'): h = '91'
+        else:
+            warn_spec = 'distanza strana'
+            h = ''
+        spec = dist+' Hs h'+h
+        warn_spec = 'a esclusione'
+        found = True
+    
+    if not(found) and (match_hs_ass6 or match_hs_ass7 or match_hs_ass8 or match_hs_ass9 or match_hs_ass10):
+        if dist in ('60', '100'): h = '84'
+        elif dist == '200': h = '76'
+        elif dist == ('300', '400'): h = '76'
+        else:
+            warn_spec = 'distanza strana'
+            h = ''
+        spec = dist+' Hs h'+h
+        warn_spec = 'a esclusione'
+        found = True
+    
+    if not(found):
+        spec = dist+' Hs'
+        warn_spec = 'non conosco l\'altezza'
+    
+    #if check > 2:
+    #    warn_spec = 'sus, ho trovato '+str(check)+' pattern'
+        
+    return spec, warn_spec
+
+
+def chiama(funzione, nome):
+    """info_ostacoli() va in errore con alcuni nomi, conta anche quello."""
+    try:
+        return funzione(nome)
+    except Exception as e:
+        return 'errore ' + type(e).__name__
+
+
+def misura(funzione, nomi):
+    """Miglior tempo su RIPETIZIONI passate di funzione su tutti i nomi."""
+    tempi = []
+    for _ in range(RIPETIZIONI):
+        start = time.perf_counter()
+        for nome in nomi:
+            chiama(funzione, nome)
+        tempi.append(time.perf_counter() - start)
+    return min(tempi)
+
+
+def classifica_scalare(nome, gara):
+    """Le due funzioni di classificazione sul nome così come è nella pagina."""
+    evento_gen, warn_gen = assegna_evento_generale(nome, gara)
+    disciplina, warn_spec = assegna_evento_specifico(nome, evento_gen)
+    return evento_gen, disciplina, warn_gen, warn_spec
+
+
+df_nomi = pd.read_csv(FILE_NOMI, keep_default_na=False)
+nomi = df_nomi['nome'].astype(str).tolist()
+gare = df_nomi['link'].astype(str).str.split('/').str[-1].tolist()
+print(f"{len(nomi)} nomi, {len(set(nomi))} distinti")
+
+# classifica_eventi() classifica una volta sola ogni chiave_evento(): deve
+# dare lo stesso risultato delle regole chiamate riga per riga
+with contextlib.redirect_stdout(io.StringIO()):
+    classificati = classifica_eventi(pd.Series(nomi), pd.Series(gare))
+    diversi_eventi = [(n, g) for n, g, c in zip(nomi, gare, classificati.itertuples(index=False))
+                      if classifica_scalare(n, g) != tuple(c)]
+if diversi_eventi:
+    print(f"classifica_eventi: {len(diversi_eventi)} nomi con risultato diverso, "
+          f"ad esempio {diversi_eventi[:5]}")
+    sys.exit(1)
+
+coppie = [('check_master', check_master_vecchio, check_master),
+          ('info_categoria', info_categoria_vecchio, info_categoria),
+          ('info_ostacoli', info_ostacoli_vecchio, info_ostacoli)]
+
+# info_categoria() stampa un avviso per ogni nome con più categorie
+with contextlib.redirect_stdout(io.StringIO()):
+    diversi = {nome_funzione: [n for n in nomi if chiama(vecchia, n) != chiama(nuova, n)]
+               for nome_funzione, vecchia, nuova in coppie}
+
+for nome_funzione, lista in diversi.items():
+    if lista:
+        print(f"{nome_funzione}: {len(lista)} nomi con risultato diverso, ad esempio {lista[:5]}")
+if any(diversi.values()):
+    sys.exit(1)
+print("Stessi risultati")
+
+with contextlib.redirect_stdout(io.StringIO()):
+    tempi = [(nome_funzione, misura(vecchia, nomi), misura(nuova, nomi))
+             for nome_funzione, vecchia, nuova in coppie]
+
+for nome_funzione, t_vecchia, t_nuova in tempi:
+    print(f"{nome_funzione:15s} prima {t_vecchia:6.3f} s, ora {t_nuova:6.3f} s "
+          f"({t_vecchia / t_nuova:.1f}x)")
@@ -0,0 +1,90 @@
+""" Tempo e memoria per fare il parsing delle pagine di esempio del sigma con
+i parser disponibili per BeautifulSoup (html.parser c'è sempre, lxml e
+html5lib se installati) e con lxml.html da solo. Da lanciare dalla cartella principale del
+repository, eventualmente con altre pagine salvate come argomenti:
+    python src/bench_parser.py [pagina.html ...] """
+import sys
+import time
+import tracemalloc
+from bs4 import BeautifulSoup
+from func_html import (PARSER_VELOCE, PARSER_TOLLERANTE, SOLO_LINK_NUOVO,
+                       SOLO_LINK_VECCHIO, SOLO_LINK_VECCHISSIMO)
+
+PAGINE = {'fuck.html': 'sigma nuovo, risultati',
+          'fuck_old.html': 'sigma vecchio, risultati'}
+RIPETIZIONI = 20
+
+# Parsing parziale usato da link_*() in func_general
+PARZIALI = {'SOLO_LINK_NUOVO': SOLO_LINK_NUOVO,
+            'SOLO_LINK_VECCHIO': SOLO_LINK_VECCHIO,
+            'SOLO_LINK_VECCHISSIMO': SOLO_LINK_VECCHISSIMO}
+
+
+def parser_disponibili():
+    """(nome, funzione che fa il parsing, funzione che conta i tag)"""
+    parser = [('html.parser', lambda html: BeautifulSoup(html, 'html.parser'),
+               lambda soup: len(soup.find_all(True)))]
+    for nome in ['lxml', 'html5lib']:
+        try:
+            __import__(nome)
+        except ImportError:
+            continue
+        parser.append((nome, lambda html, nome=nome: BeautifulSoup(html, nome),
+                       lambda soup: len(soup.find_all(True))))
+
+    # Albero di lxml senza passare da BeautifulSoup (quello che si guadagna
+    # scrivendo l'estrazione direttamente con XPath)
+    try:
+        import lxml.html
+        parser.append(('lxml.html', lxml.html.fromstring,
+                       lambda albero: sum(1 for _ in albero.iter(tag=lxml.etree.Element))))
+    except ImportError:
+        pass
+
+    return parser
+
+
+def misura(html, parse, conta_tag):
+    """Miglior tempo su RIPETIZIONI parsing, picco di memoria e numero di tag."""
+    tempi = []
+    for _ in range(RIPETIZIONI):
+        start = time.perf_counter()
+        parse(html)
+        tempi.append(time.perf_counter() - start)
+
+    # tracemalloc vede solo la memoria allocata da Python, per lxml.html
+    # l'albero sta nella memoria di libxml2 e non viene contato
+    tracemalloc.start()
+    albero = parse(html)
+    _, picco = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(tempi), picco, conta_tag(albero)
+
+
+pagine = {p: 'argomento' for p in sys.argv[1:]} or PAGINE
+print(f"parser veloce: {PARSER_VELOCE}, tollerante: {PARSER_TOLLERANTE}\n")
+
+for pagina, descrizione in pagine.items():
+    with open(pagina, 'rb') as f:
+        html = f.read()
+    print(f"{pagina} ({descrizione}, {len(html) / 1e3:.0f} kB)")
+
+    riferimento = None
+    for parser, parse, conta_tag in parser_disponibili():
+        tempo, picco, n_tag = misura(html, parse, conta_tag)
+        riferimento = riferimento or tempo
+        print(f"    {parser:12s} {tempo * 1e3:7.2f} ms ({riferimento / tempo:4.1f}x) "
+              f"{picco / 1e6:6.2f} MB  {n_tag:5d} tag")
+
+    # Solo i parziali che trovano qualcosa in questa pagina
+    for nome, strainer in PARZIALI.items():
+        for parser in ['html.parser', PARSER_VELOCE]:
+            tempo, picco, n_tag = misura(
+                html, lambda html: BeautifulSoup(html, parser, parse_only=strainer),
+                lambda soup: len(soup.find_all(True)))
+            if n_tag:
+                print(f"    {parser:12s} {tempo * 1e3:7.2f} ms ({riferimento / tempo:4.1f}x) "
+                      f"{picco / 1e6:6.2f} MB  {n_tag:5d} tag  {nome}")
+            if parser == PARSER_VELOCE:
+                break
@@ -0,0 +1,231 @@
+import pandas as pd
+from io import StringIO
+from sqlalchemy import text, table, column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+# Modifiche allo schema del database che servono a questo programma.
+# Ogni istruzione deve poter essere eseguita più volte senza fare danni
+# (IF NOT EXISTS), così aggiorna_schema() può girare a ogni avvio.
+SCHEMA_DDL = [
+    # Cache negativa di get_meet_info(): prima di questo momento non ha senso
+    # ricontrollare una gara che non aveva ancora la pagina del sigma
+    "ALTER TABLE gare ADD COLUMN IF NOT EXISTS prossimo_controllo TIMESTAMP",
+
+    # Una pagina per (codice, gara), serve a inserisci_righe(). La prima volta
+    # vengono tolti i doppioni (tiene la riga con id più basso)
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_indexes
+                       WHERE indexname = 'pagine_gara_codice_gara') THEN
+            DELETE FROM pagine_gara a USING pagine_gara b
+            WHERE a.codice = b.codice AND a.gara = b.gara AND a.id > b.id;
+            CREATE UNIQUE INDEX pagine_gara_codice_gara ON pagine_gara (codice, gara);
+        END IF;
+    END $$
+    """,
+
+    # Cache di classifica_eventi(): un nome viene classificato una volta sola
+    """
+    CREATE TABLE IF NOT EXISTS eventi_classificati (
+        nome        TEXT NOT NULL,
+        tipo_gara   TEXT NOT NULL,
+        evento_gen  TEXT,
+        disciplina  TEXT,
+        warn_gen    TEXT,
+        warn_spec   TEXT,
+        PRIMARY KEY (nome, tipo_gara)
+    )
+    """,
+
+    # Impronte delle regole di classificazione, vedi versione_regole()
+    """
+    CREATE TABLE IF NOT EXISTS versioni_regole (
+        versione    TEXT PRIMARY KEY,
+        gruppi      TEXT NOT NULL,
+        creata      TIMESTAMP NOT NULL DEFAULT now()
+    )
+    """,
+    "ALTER TABLE eventi_classificati ADD COLUMN IF NOT EXISTS versione_regole TEXT",
+    "ALTER TABLE pagine_gara ADD COLUMN IF NOT EXISTS evento_gen TEXT",
+    "ALTER TABLE pagine_gara ADD COLUMN IF NOT EXISTS versione_regole TEXT",
+
+    # Risultati letti dalle pagine del sigma, vedi inserisci_risultati()
+    """
+    CREATE TABLE IF NOT EXISTS risultati (
+        id          SERIAL PRIMARY KEY,
+        pagina_gara INTEGER NOT NULL,
+        disciplina  TEXT,
+        prestazione TEXT,
+        atleta      TEXT NOT NULL,
+        anno        TEXT,
+        categoria   TEXT,
+        club        TEXT,
+        data        TIMESTAMP,
+        luogo       TEXT,
+        link        TEXT,
+        acquisito   TIMESTAMP NOT NULL DEFAULT now()
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS risultati_pagina_gara ON risultati (pagina_gara)",
+    "ALTER TABLE pagine_gara ADD COLUMN IF NOT EXISTS scraped_ris TIMESTAMP",
+    # prestazione in numeri, vedi codifica_prestazioni()
+    "ALTER TABLE risultati ADD COLUMN IF NOT EXISTS valore INTEGER",
+    "ALTER TABLE risultati ADD COLUMN IF NOT EXISTS stato SMALLINT",
+    # titolo della batteria, vedi inserisci_risultati()
+    "ALTER TABLE risultati ADD COLUMN IF NOT EXISTS batteria TEXT",
+
+    # Miglior risultato di ogni atleta per (disciplina, categoria, stagione),
+    # vedi aggiorna_classifiche(). ordine cresce dal risultato migliore
+    """
+    CREATE TABLE IF NOT EXISTS classifiche (
+        disciplina  TEXT NOT NULL,
+        categoria   TEXT NOT NULL,
+        stagione    INTEGER NOT NULL,
+        atleta      TEXT NOT NULL,
+        anno        TEXT,
+        club        TEXT,
+        prestazione TEXT,
+        valore      INTEGER NOT NULL,
+        ordine      INTEGER NOT NULL,
+        data        TIMESTAMP,
+        luogo       TEXT,
+        risultato   INTEGER NOT NULL,
+        PRIMARY KEY (disciplina, categoria, stagione, atleta)
+    )
+    """,
+    """CREATE INDEX IF NOT EXISTS classifiche_ordine
+       ON classifiche (disciplina, categoria, stagione, ordine)""",
+
+    # Per gare_in_DB(): iscritti di una gara e risultati di un atleta in un
+    # intervallo di date
+    "CREATE INDEX IF NOT EXISTS iscritti_codice ON iscritti (codice)",
+    "CREATE INDEX IF NOT EXISTS results_atleta_data ON results (lower(atleta), data)",
+
+    # Batterie del sigma nuovo già caricate in risultati, con l'impronta della
+    # tabella: se non cambia la batteria non viene riletta
+    """
+    CREATE TABLE IF NOT EXISTS batterie_acquisite (
+        pagina_gara INTEGER NOT NULL,
+        titolo      TEXT NOT NULL,
+        impronta    TEXT NOT NULL,
+        acquisita   TIMESTAMP NOT NULL DEFAULT now(),
+        PRIMARY KEY (pagina_gara, titolo)
+    )
+    """,
+]
+
+# Sopra questo numero di righe inserisci_righe() usa COPY invece di INSERT
+SOGLIA_COPY = 500
+
+
+def aggiorna_schema(conn):
+    """Applica SCHEMA_DDL al database."""
+    for ddl in SCHEMA_DDL:
+        conn.execute(text(ddl))
+    conn.commit()
+
+
+def copia_in_tabella(conn, df, tabella):
+    """
+    Carica df in tabella con COPY ... FROM STDIN (una sola richiesta al
+    database). Le colonne di df devono esistere in tabella, None/NaN
+    diventano NULL (scritti come \\N, così le stringhe vuote restano tali).
+    Non fa commit.
+    """
+    buffer = StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep='\\N')
+    buffer.seek(0)
+
+    colonne = ', '.join(f'"{c}"' for c in df.columns)
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {tabella} ({colonne}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                           buffer)
+    finally:
+        cursor.close()
+
+
+def crea_tabella_temporanea(conn, nome, tabella, df):
+    """
+    Crea la tabella temporanea nome con le stesse colonne (e tipi) di tabella
+    e ci copia df. Viene eliminata al commit.
+    """
+    colonne = ', '.join(f'"{c}"' for c in df.columns)
+    conn.execute(text(f"DROP TABLE IF EXISTS {nome}"))
+    conn.execute(text(f"""CREATE TEMP TABLE {nome} ON COMMIT DROP AS
+                          SELECT {colonne} FROM {tabella} WITH NO DATA"""))
+    copia_in_tabella(conn, df, nome)
+
+
+def inserisci_righe(conn, tabella, df, chiavi, aggiorna=False) -> int:
+    """
+    Inserisce le righe di df in tabella saltando quelle che hanno già le
+    stesse chiavi (INSERT ... ON CONFLICT DO NOTHING, serve un indice unico su
+    chiavi). Con aggiorna=True le righe che ci sono già vengono invece
+    sovrascritte (ON CONFLICT DO UPDATE). Per pochi dati fa un solo INSERT con
+    tutte le righe, sopra SOGLIA_COPY passa da una tabella temporanea caricata
+    con COPY. Non fa commit.
+
+    Restituisce il numero di righe effettivamente inserite (o aggiornate).
+    """
+    df = df.drop_duplicates(subset=chiavi)
+    if df.empty:
+        return 0
+
+    altre = [c for c in df.columns if c not in chiavi]
+
+    if len(df) <= SOGLIA_COPY:
+        righe = df.astype(object).where(pd.notna(df), None).to_dict('records')
+        t = table(tabella, *[column(c) for c in df.columns])
+        query = pg_insert(t).values(righe)
+        if aggiorna and altre:
+            query = query.on_conflict_do_update(
+                index_elements=chiavi, set_={c: query.excluded[c] for c in altre})
+        else:
+            query = query.on_conflict_do_nothing(index_elements=chiavi)
+        return conn.execute(query).rowcount
+
+    tmp = f"tmp_{tabella}"
+    crea_tabella_temporanea(conn, tmp, tabella, df)
+
+    colonne = ', '.join(f'"{c}"' for c in df.columns)
+    if aggiorna and altre:
+        azione = 'DO UPDATE SET ' + ', '.join(f'"{c}" = EXCLUDED."{c}"' for c in altre)
+    else:
+        azione = 'DO NOTHING'
+    result = conn.execute(text(f"""
+        INSERT INTO {tabella} ({colonne})
+        SELECT {colonne} FROM {tmp}
+        ON CONFLICT ({', '.join(chiavi)}) {azione}
+    """))
+    conn.execute(text(f"DROP TABLE {tmp}"))
+
+    return result.rowcount
+
+
+def aggiorna_righe(conn, tabella, df, chiave) -> int:
+    """
+    Aggiorna in blocco le righe di tabella con i valori in df: carica df in una
+    tabella temporanea con COPY e fa un solo UPDATE ... FROM unendo su chiave.
+    Le colonne di df diverse da chiave sono quelle che vengono aggiornate.
+    Non fa commit.
+
+    Restituisce il numero di righe aggiornate.
+    """
+    if df.empty:
+        return 0
+
+    tmp = f"tmp_{tabella}"
+    crea_tabella_temporanea(conn, tmp, tabella, df)
+
+    colonne = [c for c in df.columns if c != chiave]
+    assegnazioni = ', '.join(f'"{c}" = s."{c}"' for c in colonne)
+    result = conn.execute(text(f"""
+        UPDATE {tabella} AS t SET {assegnazioni}
+        FROM {tmp} AS s
+        WHERE t."{chiave}" = s."{chiave}"
+    """))
+    conn.execute(text(f"DROP TABLE {tmp}"))
+
+    return result.rowcount
@@ -1,13 +1,66 @@
 import pandas as pd
-from bs4 import BeautifulSoup
-import requests
 import re
-from datetime import date, datetime
+import time
+import json
+import hashlib
+import inspect
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
 from sqlalchemy import create_engine, text
 from config import DB_CONFIG
+from func_http import http_get, http_head, http_get_cache
+from func_html import (parse_html, SOLO_LINK_NUOVO, SOLO_LINK_VECCHIO,
+                       SOLO_LINK_VECCHISSIMO)
+from func_db import inserisci_righe, aggiorna_righe
 
 DOMAIN = "https://www.fidal.it/risultati/"
 
+# Il sigma vecchio può avere RESULTSBYEVENT1.htm, ..., RESULTSBYEVENTN.htm.
+# Prima si provavano sempre tutte le pagine da 2 a PAGINE_MAX_SIGMA_VECCHIO.
+PAGINE_MAX_SIGMA_VECCHIO = 29
+
+# Giorni dopo la fine di una gara in cui le pagine del sigma possono ancora
+# cambiare (risultati caricati in ritardo, correzioni). Passati questi le
+# pagine di una gara con i risultati vengono prese solo dalla cache.
+GIORNI_GARA_APERTA = 7
+
+# Cache negativa: se una gara non ha ancora la pagina del sigma non la
+# ricontrollo prima di un'attesa che dipende da quanto manca alla gara.
+# (giorni mancanti a data_inizio maggiori di, attesa)
+ATTESE_PAGINA_MANCANTE = [
+    (14, timedelta(days=1)),
+    (3, timedelta(hours=6)),
+    (0, timedelta(hours=1)),
+]
+ATTESA_PAGINA_MANCANTE_MIN = timedelta(minutes=10) # gare in corso
+# Dopo data_fine la pagina può ancora comparire per qualche giorno, poi
+# diventa sempre meno probabile e si ricontrolla sempre più di rado.
+GIORNI_GRAZIA_PAGINA_MANCANTE = 2
+# (giorni passati dalla fine della grazia maggiori di, attesa)
+ATTESE_GARA_PASSATA = [
+    (30, timedelta(days=7)),
+    (0, timedelta(days=1)),
+]
+
+# Pagine (colonna gara di pagine_gara) che assegna_evento_generale() considera
+# 'altro' qualunque sia il nome
+PREFISSI_GARA_ALTRO = ['list', 'soc', 'partecipanti', 'risultat']
+
+# Cache di classifica_eventi(): (nome, tipo_gara) -> (evento_gen, disciplina,
+# warn_gen, warn_spec). Viene anche salvata nella tabella eventi_classificati
+_CACHE_EVENTI = {}
+_EVENTI_NUOVI = set() # chiavi classificate e non ancora salvate nel database
+
+# Conta le richieste fatte da conta_pagine_sigma_vecchio() e quelle risparmiate
+# rispetto al vecchio ciclo da 2 a 29. Condiviso tra i thread di get_meet_info()
+STATISTICHE_PAGINE = {'richieste': 0, 'risparmiate': 0}
+
+# Gare classificate da classifica_sigma() guardando solo Index.htm ('impronta')
+# e gare per cui è servito provare le altre pagine ('tentativi')
+STATISTICHE_CLASSIFICA = {'impronta': 0, 'tentativi': 0}
+_lock_statistiche = Lock()
+
 def get_sqlalchemy_connection_string():
     """Generates the connection string for SQLAlchemy."""
     return f"postgresql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
@@ -42,13 +95,13 @@ def extract_meet_codes_from_calendar(anno, mese, livello, regione, tipo, categor
             f"submit=Invia"
         )
 
-    response = requests.get(url)
+    response = http_get(url)
 
     if response.status_code != 200:
         print("Failed to fetch the webpage. status code:", response.status_code)
         return pd.DataFrame()
         
-    soup = BeautifulSoup(response.text, 'html.parser')
+    soup = parse_html(response.text)
     table = soup.find('table', class_='table')
 
     data_inizio_gara = []
@@ -144,37 +197,218 @@ def update_gare_database(anno, mese='', regione='', categoria='', tipo=''):
             print("Nessun nuovo codice gara da aggiungere")
 
 
-def updates_DB_gara_row(row, conn):
+def updates_DB_gare_rows(rows, conn):
     """
-    Modifica le colonne sigma, status and aggiornato di una riga della tabella
-    gare
+    Modifica le colonne sigma, status, aggiornato e prossimo_controllo di più
+    righe della tabella gare con un solo UPDATE e un solo commit
+    rows: lista di dizionari con codice e le colonne da modificare
     """
-    sql = text("""
-        UPDATE gare SET
-            sigma = :sigma,
-            status = :status,
-            aggiornato = :aggiornato
-        WHERE codice = :codice
-    """)
-    conn.execute(sql, {
-        'sigma': row['sigma'],
-        'status': row['status'],
-        'aggiornato': row['aggiornato'],
-        'codice': row['codice'],
-    })
+    if not rows:
+        return
+
+    df = pd.DataFrame(rows, columns=['codice', 'sigma', 'status', 'aggiornato',
+                                     'prossimo_controllo'])
+    aggiorna_righe(conn, 'gare', df, 'codice')
     conn.commit()
 
 
+def prossimo_controllo_gara(data_inizio, data_fine, adesso):
+    """
+    Quando ricontrollare una gara che non ha ancora la pagina del sigma:
+    una volta al giorno se mancano settimane, ogni pochi minuti mentre è in
+    corso (fino a GIORNI_GRAZIA_PAGINA_MANCANTE giorni dopo data_fine), poi
+    di nuovo una volta al giorno e dopo un mese una volta alla settimana.
+    """
+    inizio = pd.Timestamp(data_inizio).date()
+    fine = pd.Timestamp(data_fine).date() if pd.notna(data_fine) else inizio
+
+    giorni = (inizio - adesso.date()).days
+    for giorni_min, attesa in ATTESE_PAGINA_MANCANTE:
+        if giorni > giorni_min:
+            return adesso + attesa
+
+    giorni_passati = (adesso.date() - fine).days - GIORNI_GRAZIA_PAGINA_MANCANTE
+    for giorni_min, attesa in ATTESE_GARA_PASSATA:
+        if giorni_passati > giorni_min:
+            return adesso + attesa
+    return adesso + ATTESA_PAGINA_MANCANTE_MIN
+
+
+def _conta_classifica(modo):
+    with _lock_statistiche:
+        STATISTICHE_CLASSIFICA[modo] += 1
+
+
+def status_pagina(url):
+    """
+    Restituisce lo status code di una pagina senza scaricarne il contenuto.
+    Usa una richiesta HEAD e torna a una GET in streaming, chiusa appena
+    arrivano gli header, solo se il server risponde male alla HEAD (qualsiasi
+    cosa che non sia 200 o 404, es. 405 Method Not Allowed).
+    """
+    status = http_head(url, allow_redirects=True).status_code
+    if status in (200, 404):
+        return status
+
+    with http_get(url, stream=True) as r:
+        return r.status_code
+
+
+def conta_pagine_sigma_vecchio(base_url, html_pagina1):
+    """
+    Trova quante pagine RESULTSBYEVENTN.htm (o ENTRYLISTBYEVENTN.htm) ha una
+    gara del sigma vecchio, sapendo che la pagina 1 esiste.
+    Prima legge i link alle altre pagine dentro la pagina 1, poi controlla con
+    una sola richiesta che la pagina successiva non esista. Se nella pagina 1
+    non ci sono link (o sono sbagliati) fa una ricerca esponenziale e poi
+    binaria, assumendo che le pagine siano numerate senza buchi.
+
+    base_url:     es. https://www.fidal.it/risultati/2022/REG28833/RESULTSBYEVENT
+    html_pagina1: testo della pagina 1
+
+    Restituisce il numero di pagine N
+    """
+
+    prefisso = base_url.split('/')[-1]
+    richieste = 0
+
+    def esiste(jj):
+        nonlocal richieste
+        richieste += 1
+        return status_pagina(f"{base_url}{jj:d}.htm") == 200
+
+    # Numeri di pagina linkati dalla pagina 1
+    numeri = [int(n) for n in re.findall(rf"{prefisso}(\d+)\.htm", html_pagina1,
+                                         re.IGNORECASE)]
+    N = min(max(numeri, default=1), PAGINE_MAX_SIGMA_VECCHIO)
+
+    lo = N    # ultima pagina che so che esiste
+    hi = None # prima pagina che so che non esiste
+
+    # Controllo che non ci siano altre pagine dopo l'ultima linkata
+    if N == PAGINE_MAX_SIGMA_VECCHIO:
+        hi = N + 1
+    elif N > 1:
+        if esiste(N + 1):
+            lo = N + 1
+        else:
+            hi = N + 1
+
+    # Ricerca esponenziale, poi binaria tra lo e hi
+    if hi is None:
+        hi = lo + 1
+        while hi <= PAGINE_MAX_SIGMA_VECCHIO and esiste(hi):
+            lo = hi
+            hi = min(2 * hi, PAGINE_MAX_SIGMA_VECCHIO + 1)
+
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if esiste(mid):
+            lo = mid
+        else:
+            hi = mid
+    N = lo
+
+    if N > 20:
+        print('ATTENZIONE questa gara ha più di 20 link:', f"{base_url}21.htm")
+
+    with _lock_statistiche:
+        STATISTICHE_PAGINE['richieste'] += richieste
+        STATISTICHE_PAGINE['risparmiate'] += PAGINE_MAX_SIGMA_VECCHIO - 1 - richieste
+
+    return N
+
+
+def impronta_sigma(html):
+    """
+    Riconosce la versione del sigma dal testo di Index.htm, senza fare altre
+    richieste, guardando dove puntano i link della home:
+     - Risultati/...        nuovo con risultati
+     - Iscrizioni/...       nuovo senza risultati
+     - RESULTSBYEVENT/ENTRYLISTBYEVENT   vecchio, ma per sapere se ci sono i
+                            risultati e quante pagine ha serve la pagina 1
+     - a class='idx_link'   vecchissimo
+    Restituisce (sigma, status). sigma è None se non riconosco la pagina,
+    status è None se non si può capire da Index.htm.
+    """
+    soup = parse_html(html)
+    hrefs = [a.get('href') or '' for a in soup.find_all('a')]
+    hrefs = [href for href in hrefs if not href.startswith('http')]
+
+    if any('Risultati/' in href for href in hrefs):
+        return 'nuovo', 'risultati'
+    if any('Iscrizioni/' in href for href in hrefs):
+        return 'nuovo', 'iscritti'
+    if any(re.search(r"(RESULTS|ENTRYLIST)BYEVENT\d+\.htm", href, re.IGNORECASE)
+           for href in hrefs):
+        return 'vecchio', None
+
+    a_elements = soup.find_all('a', class_='idx_link')
+    if a_elements:
+        return 'vecchissimo', status_sigma_vecchissimo(a_elements)
+
+    return None, None
+
+
+def status_sigma_vecchissimo(a_elements):
+    """
+    a_elements: link class='idx_link' della home di una gara con sigma
+    vecchissimo. Restituisce 'risultati' o 'iscritti'
+    """
+    # L'unica differenza costante tra colonna di iscritti e colonna di
+    # risultati sembra essere che quella di iscritti contine href del tipo
+    # GaraLXXX.htm oppure StaffXXX.htm
+    # mentre quella di risultati e' sempre GaraXXX.htm
+    for a in a_elements:
+        href = a.get("href")
+        if href and (re.match(r"Gara\d{3}\.htm", href) or re.match(r"Diffr.*\.htm", href)):
+            return 'risultati'
+
+    return 'iscritti'
+
+
+def classifica_sigma_vecchio(codice, anno):
+    """
+    Controlla se la gara ha le pagine del sigma vecchio, con o senza risultati,
+    e quante sono. Restituisce (sigma, status) oppure None se non le trova.
+    """
+    # Della pagina 1 serve anche il testo per contare le pagine, quindi uso
+    # una GET in streaming: il contenuto viene scaricato solo se esiste
+    url2 = f"{DOMAIN}{anno}/{codice}/RESULTSBYEVENT1.htm"                
+    request2 = http_get(url2, stream=True)
+    if request2.status_code == 200: # trovato vecchio con risultati
+        # Possono esistere anche
+        # /RESULTSBYEVENT2.htm, /RESULTSBYEVENT3.htm, ..., /RESULTSBYEVENTN.htm
+        N = conta_pagine_sigma_vecchio(f"{DOMAIN}{anno}/{codice}/RESULTSBYEVENT",
+                                       request2.text)
+        return f"vecchio #{N:d}", 'risultati'
+    request2.close()
+    
+    url2_1 = f"{DOMAIN}{anno}/{codice}/entrylistbyevent1.htm"            
+    request2_1 = http_get(url2_1, stream=True)
+    if request2_1.status_code == 200: # trovato vecchio senza risultati
+        # Possono esistere anche
+        # /ENTRYLISTBYEVENT2.htm, /ENTRYLISTBYEVENT3.htm, ..., /ENTRYLISTBYEVENTN.htm
+        N = conta_pagine_sigma_vecchio(f"{DOMAIN}{anno}/{codice}/ENTRYLISTBYEVENT",
+                                       request2_1.text)
+        return f"vecchio #{N:d}", 'iscritti'
+    request2_1.close()
+
+    return None
+
+
 def classifica_sigma(codice, anno):
     """
     Capisce che versione di sigma viene utilizzato a una gara e restituisce
     sigma: versione del sigma usata dalla gara
     status: NULL, iscritti, risultati
+    Di solito basta Index.htm (vedi impronta_sigma()), le altre pagine vengono
+    provate solo se la home non basta.
     """
 
     # link della home del sigma
     url3 = f"{DOMAIN}{anno}/{codice}/Index.htm" 
-    request_main = requests.get(url3)
+    request_main = http_get(url3)
     r3 = request_main.status_code
     
     # E' comune a tutti, quindi deve esistere se esiste una pagina del sigma
@@ -186,85 +420,51 @@ def classifica_sigma(codice, anno):
     # come risposta 200 o 404.
     elif r3 == 200:
 
+        ## Proviamo a capirlo dalla home
+        sigma, status = impronta_sigma(request_main.text)
+        if sigma in ('nuovo', 'vecchissimo'):
+            _conta_classifica('impronta')
+            return sigma, status
+
+        if sigma == 'vecchio':
+            results = classifica_sigma_vecchio(codice, anno)
+            if results is not None:
+                _conta_classifica('impronta')
+                return results
+
+        ## Dalla home non si capisce, vado per tentativi
+        _conta_classifica('tentativi')
+
         ## Vediamo se è sigma nuovo
         url1 = f"{DOMAIN}{anno}/{codice}/Risultati/IndexRisultatiPerGara.html"
-        r1 = requests.get(url1).status_code
+        r1 = status_pagina(url1)
         if r1 == 200: # trovato nuovo con risultati                                                                               
             return 'nuovo', 'risultati'
         
         url1_1 = f"{DOMAIN}{anno}/{codice}/Iscrizioni/IndexPerGara.html"     
-        r1_1 = requests.get(url1_1).status_code
+        r1_1 = status_pagina(url1_1)
         if r1_1 == 200: # trovato nuovo ma senza risultati
             return 'nuovo', 'iscritti'
         
         ## Vediamo se è sigma vecchio
-        url2 = f"{DOMAIN}{anno}/{codice}/RESULTSBYEVENT1.htm"                
-        r2 = requests.get(url2).status_code
-        if r2 == 200: # trovato vecchio con risultati
-            sigma = 'vecchio #1'
-            
-            # Possono esistere anche
-            # /RESULTSBYEVENT2.htm, /RESULTSBYEVENT3.htm, ..., /RESULTSBYEVENTN.htm
-            for jj in range(2, 30):
-                
-                url2_jj = f"{DOMAIN}{anno}/{codice}/RESULTSBYEVENT{jj:d}.htm"
-                r2_jj = requests.get(url2_jj).status_code
-                if r2_jj == 200:
-                    if jj == 21:
-                        print('ATTENZIONE questa gara ha più di 20 link:', url2_jj)
-                    sigma = f"vecchio #{jj:d}"
-
-                else:
-                    continue
-                
-            return sigma, 'risultati'
-        
-        url2_1 = f"{DOMAIN}{anno}/{codice}/entrylistbyevent1.htm"            
-        r2_1 = requests.get(url2_1).status_code
-        if r2_1 == 200: # trovato vecchio senza risultati
-            sigma = 'vecchio #1'
-            
-            # Possono esistere anche
-            # /ENTRYLISTBYEVENT2.htm, /ENTRYLISTBYEVENT3.htm, ..., /ENTRYLISTBYEVENTN.htm
-            for jj in range(2, 30):
-                
-                url2_jj = f"{DOMAIN}{anno}/{codice}/ENTRYLISTBYEVENT{jj:d}.htm"
-                r2_jj = requests.get(url2_jj).status_code
-                if r2_jj == 200:
-                    if jj == 21:
-                        print('ATTENZIONE questa gara ha più di 20 link:', url2_jj)
-                    sigma = f"vecchio #{jj:d}"
-
-                else:
-                    continue
-                
-            return sigma, 'iscritti'
+        if sigma != 'vecchio': # se no l'ho già controllato
+            results = classifica_sigma_vecchio(codice, anno)
+            if results is not None:
+                return results
 
         ## Se non è pan è polenta. Questo deve essere sigma vecchissimo
         # Controllo se ci sono link di risultati
-
-        soup = BeautifulSoup(request_main.text, 'html.parser')
+        soup = parse_html(request_main.text)
         a_elements = soup.find_all('a', class_='idx_link')
-        # L'unica differenza costante tra colonna di iscritti e colonna di
-        # risultati sembra essere che quella di iscritti contine href del tipo
-        # GaraLXXX.htm oppure StaffXXX.htm
-        # mentre quella di risultati e' sempre GaraXXX.htm
-        for a in a_elements:
-            href = a.get("href")
-            match1 = re.match(r"Gara\d{3}\.htm", href)
-            match2 = re.match(r"Diffr.*\.htm", href)
-
-            if href and (match1 or match2):
-                return 'vecchissimo', 'risultati'
-        
-        return 'vecchissimo', 'iscritti'
+        return 'vecchissimo', status_sigma_vecchissimo(a_elements)
         
     else:
         print(f"la risposta della pagina è {r3:d}... e mo'?")
         return None
 
 
-def get_meet_info(conn, update_condition, where_clause=""):
+def get_meet_info(conn, update_condition, where_clause="", n_workers=1,
+                  flush_size=200):
     """
     Controlla la versione del sigma, se ci sono iscritti e/o risultati e lascia
     la data dell'ultimo controllo per ogni gara filtrata da 
@@ -277,6 +477,16 @@ def get_meet_info(conn, update_condition, where_clause=""):
                               assieme al quelle che hanno Sigma vecchio #1 e #2
                      'null'   aggiorna le righe con status null
                      'custom' utilizza la where_clause in input
+                     Tranne che con 'custom', le gare senza pagina del sigma
+                     vengono saltate fino a prossimo_controllo (vedi
+                     prossimo_controllo_gara())
+    n_workers:       numero di gare classificate in parallelo. Le richieste al
+                     sigma vengono fatte da n_workers thread, mentre le
+                     scritture sul database restano tutte nel thread principale
+                     (conn non è thread-safe)
+    flush_size:      numero di gare classificate che vengono scritte sul
+                     database tutte assieme. Quelle rimaste in sospeso vengono
+                     scritte anche se il ciclo si interrompe (es. Ctrl+C)
     """
     
     todayis = datetime.today().date()
@@ -329,6 +539,10 @@ def get_meet_info(conn, update_condition, where_clause=""):
         return 
     
     query = f"SELECT * FROM gare {where_clause}"
+    if update_condition != 'custom':
+        query = f"""SELECT * FROM ({query}) AS g
+                    WHERE prossimo_controllo IS NULL
+                    OR prossimo_controllo <= CURRENT_TIMESTAMP"""
     df_gare = pd.read_sql(query, conn).reset_index(drop=True)
 
     if df_gare.empty:
@@ -339,37 +553,97 @@ def get_meet_info(conn, update_condition, where_clause=""):
     tot = len(df_gare)
     print(f"Aggiorno {tot} righe")
 
+    STATISTICHE_PAGINE['richieste'] = 0
+    STATISTICHE_PAGINE['risparmiate'] = 0
+    STATISTICHE_CLASSIFICA['impronta'] = 0
+    STATISTICHE_CLASSIFICA['tentativi'] = 0
+
     jj = 0 # conta le righe modificate
-    for ii, row in df_gare.iterrows():
-        print(f"\t{ii:d}/{tot:d}", end="\r")
+    falliti = 0
+    da_scrivere = []
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = {
+            executor.submit(classifica_sigma, row['codice'],
+                            str(row['data_inizio'].year)): idx
+            for idx, row in df_gare.iterrows()
+        }
+
+        try:
+            # Le gare arrivano nell'ordine in cui finiscono, non in quello di df_gare
+            for ii, future in enumerate(as_completed(futures)):
+                print(f"\t{ii:d}/{tot:d}", end="\r")
+
+                row = df_gare.loc[futures[future]]
+                try:
+                    results = future.result()
+                except Exception as e:
+                    # Timeout o connessione persa su una gara: la salto e
+                    # riprovo al prossimo giro, senza fermare le altre.
+                    # classifica_sigma() non usa il DB, KeyboardInterrupt
+                    # non è un Exception e ferma tutto
+                    falliti += 1
+                    print(f"\nError: {e}")
+                    print(f"Gara: {row['codice']}")
+                    continue
 
-        results = classifica_sigma(row['codice'], str(row['data_inizio'].year))
+                if results is None:
+                    continue
 
-        if results is not None:
-            if row['status'] != results[1]:
-                jj += 1
+                if row['status'] != results[1]:
+                    jj += 1
 
-            row['sigma'] = results[0]
-            row['status'] = results[1]
-            row['aggiornato'] = todayis
-            updates_DB_gara_row(row, conn)
+                if results[0] is None:
+                    prossimo_controllo = prossimo_controllo_gara(
+                        row['data_inizio'], row['data_fine'], datetime.now())
+                else:
+                    prossimo_controllo = None
+
+                da_scrivere.append({'codice': row['codice'],
+                                    'sigma': results[0],
+                                    'status': results[1],
+                                    'aggiornato': todayis,
+                                    'prossimo_controllo': prossimo_controllo})
+
+                if len(da_scrivere) >= flush_size:
+                    # Il buffer si svuota prima di scrivere: se la scrittura
+                    # fallisce quelle righe non vengono riprovate qui sotto
+                    blocco, da_scrivere = da_scrivere, []
+                    updates_DB_gare_rows(blocco, conn)
+
+        except BaseException:
+            # Se il ciclo si è interrotto (Ctrl+C, errore del DB) non serve
+            # finire le altre gare, ma quelle già classificate si provano a
+            # salvare. Se non si riesce l'errore che esce è comunque il primo
+            executor.shutdown(wait=False, cancel_futures=True)
+            try:
+                conn.rollback()
+                updates_DB_gare_rows(da_scrivere, conn)
+            except Exception as e:
+                print(f"\nError: {len(da_scrivere)} gare classificate non salvate: {e}")
+            raise
+
+        else:
+            updates_DB_gare_rows(da_scrivere, conn)
 
     print(f"{jj} righe sono state aggiornate")
+    if falliti > 0:
+        print(f"{falliti} gare non controllate per errori, riprovo al prossimo giro")
+    print(f"Sigma riconosciuto dalla home: {STATISTICHE_CLASSIFICA['impronta']}, "
+          f"per tentativi: {STATISTICHE_CLASSIFICA['tentativi']}")
+    if STATISTICHE_PAGINE['richieste'] > 0:
+        print(f"Pagine del sigma vecchio: {STATISTICHE_PAGINE['richieste']} "
+              f"richieste, {STATISTICHE_PAGINE['risparmiate']} risparmiate")
 
 
 def update_DB_pagine_gara(data, conn):
-    data[['disciplina', 'status', 'warn_gen', 'warn_spec', 'status',
-          'scraped_iscr', 'scraped_start', 'scraped_ris']] = None
-    
-    # Prende i link che ci sono ora
-    query1 = f"SELECT * FROM pagine_gara WHERE codice = '{data.loc[0, 'codice']}'"
-    gare_old = pd.read_sql(query1, conn)
-
-    # Li toglie da quelli nuovi
-    new_data = data[~data['gara'].isin(gare_old['gara'])]
-
-    # Inserisci i link nuovi
-    new_data.to_sql("pagine_gara", conn, if_exists='append', index=False)
+    """
+    Usata dalle link_*(). Aggiunge a pagine_gara i link di una gara che non ci
+    sono ancora e aggiorna status e data di scraping della gara.
+    Restituisce il numero di link aggiunti.
+    """
+    # Inserisce solo i link nuovi, quelli con (codice, gara) già presenti
+    # vengono saltati dal database (ON CONFLICT DO NOTHING)
+    n_new = inserisci_righe(conn, 'pagine_gara', data, ['codice', 'gara'])
 
     # Aggiorna gare per ricordare la data in cui questa gara e stata screpata
     # Controlliamo se ci sono anche risultati
@@ -394,7 +668,21 @@ def update_DB_pagine_gara(data, conn):
 
     conn.commit()
 
-    return len(new_data)
+    return n_new
+
+
+def gara_stabile_dal(row):
+    """
+    Timestamp (secondi, come time.time()) da cui le pagine del sigma di una
+    gara (riga della tabella gare) non cambiano più: fine del giorno
+    data_fine + GIORNI_GARA_APERTA. None se la gara non ha ancora i
+    risultati. Una pagina salvata in cache prima di questo momento (per
+    esempio il giorno della gara) va comunque ricontrollata.
+    """
+    if row['status'] != 'risultati' or pd.isna(row['data_fine']):
+        return None
+    giorno = pd.Timestamp(row['data_fine']).date() + timedelta(days=GIORNI_GARA_APERTA + 1)
+    return datetime.combine(giorno, datetime.min.time()).timestamp()
 
 
 def link_sigma_nuovo(row, conn):
@@ -416,10 +704,11 @@ def link_sigma_nuovo(row, conn):
     if row['status'] == 'risultati':
         urls.append(f"{DOMAIN}{anno}/{cod}/Risultati/IndexRisultatiPerGara.html")
 
+    stabile_dal = gara_stabile_dal(row)
     data = pd.DataFrame(columns=['nome', 'gara'])
     for url in urls:
-        r = requests.get(url).text
-        els = BeautifulSoup(r, 'html.parser').find_all('a', class_='link-style')
+        r = http_get_cache(url, stabile_dal).text
+        els = parse_html(r, parse_only=SOLO_LINK_NUOVO).find_all('a', class_='link-style')
         
         for el in els:
             link = el['href'][:50]
@@ -476,10 +765,11 @@ def link_risultati_sigma_vecchio(row, conn):
         if row['status'] == 'risultati':
             urls.append(url.replace('RESULTS', 'ENTRYLIST'))
 
+    stabile_dal = gara_stabile_dal(row)
     data = pd.DataFrame(columns=['nome', 'gara'])
     for url in urls:
-        r = requests.get(url).text
-        soup = BeautifulSoup(r, 'html.parser')
+        r = http_get_cache(url, stabile_dal).text
+        soup = parse_html(r, veloce=False, parse_only=SOLO_LINK_VECCHIO)
         elements = soup.find_all('td', id='idx_colonna1')
 
         for element in elements:
@@ -527,8 +817,8 @@ def link_risultati_sigma_vecchissimo(row, conn):
     anno = row['data_inizio'].year
     url = f"{DOMAIN}{anno:d}/{cod}/Index.htm"
 
-    r = requests.get(url).text
-    soup = BeautifulSoup(r, 'html.parser')
+    r = http_get_cache(url, gara_stabile_dal(row)).text
+    soup = parse_html(r, parse_only=SOLO_LINK_VECCHISSIMO)
     elements = soup.find_all('a', class_='idx_link')
     
     data = pd.DataFrame(columns=['nome', 'gara'])
@@ -720,7 +1010,7 @@ def assegna_evento_generale(nome_evento, gara):
             warning_evento = '\'+\' sus'
     
     # ALTRO
-    for word in ['list','soc','partecipanti','risultat']:
+    for word in PREFISSI_GARA_ALTRO:
         if gara.startswith(word):
             evento_generale = 'altro'
             warning_evento= ''
@@ -838,6 +1128,68 @@ def assegna_evento_generale(nome_evento, gara):
     return evento_generale, warning_evento
 
 
+# Segnali di categoria cercati nel nome dell'evento (già in minuscolo).
+# Ogni tabella viene compilata in una sola regex da _compila_segnali(), così
+# il nome viene letto una volta sola invece che con un re.search() per pattern
+SEGNALI_CATEGORIA = {
+    'SM': [r'\badulti u\b', r'uomini', r'men', r'maschile', r'\bm\b', r'\bu\b',
+           r'\bpromesse u\b', r'\bpromesse m\b', r'\bpm\b'],
+    'SF': [r'donne', r'women', r'femminile', r'\bf\b', r'\bd\b', r'\badulti d\b',
+           r'\bpromesse d\b', r'\bpromesse f\b', r'\bpf\b'],
+    'E':  [r'\besordienti\b', r'\bef\d+', r'\bem\d+', r'\bef\b'],
+    'R':  [r'\bragazz', r'\brm\b', r'\brf\b'],
+    'CM': [r'cadetti', r'\bcm\b'],
+    'CF': [r'cadette', r'\bcf\b'],
+    'AM': [r'allievi', r'\bam\b'],
+    'AF': [r'allieve', r'\baf\b'],
+    'JM': [r'junior u', r'junior m', r'juniores u', r'juniores m', r'\bjm\b'],
+    'JF': [r'junior d', r'junior f', r'juniores d', r'juniores f', r'\bjf\b'],
+}
+
+# In info_categoria() vince l'ultima categoria trovata in quest'ordine.
+# JM e JF sono scambiati da sempre, restano così per non cambiare i risultati
+ORDINE_CATEGORIE = [('SM', 'SM'), ('SF', 'SF'), ('E', 'E'), ('R', 'R'),
+                    ('CM', 'CM'), ('CF', 'CF'), ('AM', 'AM'), ('AF', 'AF'),
+                    ('JM', 'JF'), ('JF', 'JM')]
+
+# Come SEGNALI_CATEGORIA ma con le varianti usate da info_ostacoli()
+SEGNALI_OSTACOLI = {
+    'E':  [r'esordienti', r'\bef\d+', r'\bem\d+', r'\bef\b', r'\bem\b',
+           r'\bef\w\b', r'\bem\w\b'],
+    'R':  [r'ragazz', r'\brm\b', r'\brf\b'],
+    'CM': SEGNALI_CATEGORIA['CM'],
+    'CF': SEGNALI_CATEGORIA['CF'],
+    'AM': SEGNALI_CATEGORIA['AM'],
+    'AF': SEGNALI_CATEGORIA['AF'],
+    'JM': SEGNALI_CATEGORIA['JM'],
+    'JF': SEGNALI_CATEGORIA['JF'],
+    'SM': [r'uomini', r'men', r'maschil\w', r'\bm\b', r'\bu\b'],
+    'SF': [r'donne', r'women', r'femminil\w', r'\bf\b', r'\bd\b'],
+}
+
+
+def _compila_segnali(segnali):
+    """
+    Una sola regex per una tabella {etichetta: [pattern, ...]}. Ogni etichetta
+    è un gruppo con nome dentro un lookahead, quindi finditer() prova tutte le
+    alternative a ogni posizione (anche sovrapposte) e match.lastgroup dice
+    quale etichetta è stata trovata.
+    """
+    gruppi = [f"(?P<{etichetta}>{'|'.join(patterns)})"
+              for etichetta, patterns in segnali.items()]
+    return re.compile('(?=' + '|'.join(gruppi) + ')')
+
+
+_RE_CATEGORIA = _compila_segnali(SEGNALI_CATEGORIA)
+_RE_OSTACOLI = _compila_segnali(SEGNALI_OSTACOLI)
+_RE_MASTER = re.compile(r'[smf]\d{2}') # S35, M70+, SM45, F90, SF50
+
+
+def trova_segnali(regex, nome) -> set:
+    """Etichette di una tabella di segnali (regex compilata) trovate in nome."""
+    return {m.lastgroup for m in regex.finditer(nome)}
+
+
 def check_master(nome):
     """ Mi fido del me stesso di qualche anno fa, non ho intenzione di
     controllare quesa funzione """
@@ -847,17 +1199,7 @@ def check_master(nome):
     
     nome = nome.lower()
     
-    match_master0 = re.search(r'master', nome)
-    match_master1 = re.search(r's\d{2}', nome.replace(' ',''))
-    match_master2 = re.search(r'm\d{2}', nome.replace(' ',''))     # M70+
-    match_master3 = re.search(r'sm\d{2}', nome.replace(' ',''))    # SM45
-    match_master4 = re.search(r'f\d{2}', nome.replace(' ',''))     # F90
-    match_master5 = re.search(r'sf\d{2}', nome.replace(' ',''))    # SF50
-    
-    if match_master0 or match_master1 or match_master2 or match_master3 or match_master4 or match_master5:
-        return True
-    else:
-        return False
+    return 'master' in nome or _RE_MASTER.search(nome.replace(' ', '')) is not None
 
 
 def info_categoria(nome):
@@ -872,105 +1214,15 @@ def info_categoria(nome):
     ## junior e promesse donne hanno le stesse gare delle assolute
     
     nome = nome.strip().lower()
+    segnali = trova_segnali(_RE_CATEGORIA, nome)
     cat = ''
     check = 0
     
-    # Assoluti
-    match_hs_ass0 = re.search(r'\badulti u\b', nome)   # adulti u
-    match_hs_ass1 = re.search(r'uomini', nome)         # uomini
-    match_hs_ass2 = re.search(r'men', nome)            # men
-    match_hs_ass3 = re.search(r'maschile', nome)       # maschile
-    match_hs_ass4 = re.search(r'\bm\b', nome)          # m
-    match_hs_ass5 = re.search(r'\bu\b', nome)          # u
-    match_hs_ass6 = re.search(r'\bpromesse u\b', nome) # promesse u
-    match_hs_ass7 = re.search(r'\bpromesse m\b', nome) # promesse m
-    match_hs_ass8 = re.search(r'\bpm\b', nome)         # pm
-    
-    
-    match_hs_ass9 = re.search(r'donne', nome)          # donne
-    match_hs_ass10 = re.search(r'women', nome)         # women
-    match_hs_ass11 = re.search(r'femminile', nome)     # femminile
-    match_hs_ass12= re.search(r'\bf\b', nome)          # f
-    match_hs_ass13 = re.search(r'\bd\b', nome)         # d
-    match_hs_ass14 = re.search(r'\badulti d\b', nome)  # adulti d
-    match_hs_ass15 = re.search(r'\bpromesse d\b', nome) # promesse d
-    match_hs_ass16 = re.search(r'\bpromesse f\b', nome) # promesse f
-    match_hs_ass17 = re.search(r'\bpf\b', nome)         # pf
-    
-    
-    if match_hs_ass0 or match_hs_ass1 or match_hs_ass2 or match_hs_ass3 or match_hs_ass4 or match_hs_ass5 or match_hs_ass6 or match_hs_ass7 or match_hs_ass8:
-        cat = 'SM'
-    
-    if match_hs_ass9 or match_hs_ass10 or match_hs_ass11 or match_hs_ass12 or match_hs_ass13 or match_hs_ass14 or match_hs_ass15 or match_hs_ass16 or match_hs_ass17:
-        cat = 'SF'
-    
-    # Esordienti
-    match_eso1 = re.search(r'\besordienti\b', nome) # esordienti
-    match_eso2 = re.search(r'\bef\d+', nome)        # EF8
-    match_eso3 = re.search(r'\bem\d+', nome)        # EM5
-    match_eso4 = re.search(r'\bef\b', nome)         # EF
-    match_eso5 = re.search(r'\bef\b', nome)         # EM
-    
-    if match_eso1 or match_eso2 or match_eso3 or match_eso4 or match_eso5:
-        check += 1
-        cat = 'E'
-
-    # Ragazzi
-    match_hs_r0 = re.search(r'\bragazz', nome)   # ragazz
-    match_hs_r1 = re.search(r'\brm\b', nome)   # rm
-    match_hs_r2 = re.search(r'\brf\b', nome)   # rf
-    
-    if match_hs_r0 or match_hs_r1 or match_hs_r2:
-        cat = 'R'
-        check += 1
-    
-    # Cadetti
-    match_hs_c1 = re.search(r'cadetti', nome)  # cadetti
-    match_hs_c2 = re.search(r'\bcm\b', nome)   # cm
-    match_hs_c3 = re.search(r'cadette', nome)  # cadettte
-    match_hs_c4 = re.search(r'\bcf\b', nome)   # cf
-    
-    if match_hs_c1 or match_hs_c2:
-        cat = 'CM'
-        check += 1
-
-    if match_hs_c3 or match_hs_c4:
-        cat = 'CF'
-        check += 1
-    
-    # Allievi
-    match_hs_a1 = re.search(r'allievi', nome)  # allievi
-    match_hs_a2 = re.search(r'\bam\b', nome)   # am
-    match_hs_a3 = re.search(r'allieve', nome)  # allieve
-    match_hs_a4 = re.search(r'\baf\b', nome)   # af
-    
-    if match_hs_a1 or match_hs_a2:
-        cat = 'AM'
-        check += 1
-
-    if match_hs_a3 or match_hs_a4:
-        cat = 'AF'
-        check += 1
-    
-    # Junior
-    match_hs_j1 = re.search(r'junior u', nome)     # junior u
-    match_hs_j2 = re.search(r'junior m', nome)     # junior m
-    match_hs_j3 = re.search(r'juniores u', nome)   # juniores u
-    match_hs_j4 = re.search(r'juniores m', nome)   # juniores m
-    match_hs_j5 = re.search(r'\bjm\b', nome)       # jm
-    match_hs_j6 = re.search(r'junior d', nome)     # junior d
-    match_hs_j7 = re.search(r'junior f', nome)     # junior f
-    match_hs_j8 = re.search(r'juniores d', nome)   # juniores d
-    match_hs_j9 = re.search(r'juniores f', nome)   # juniores f
-    match_hs_j10 = re.search(r'\bjf\b', nome)      # jf
-    
-    if match_hs_j1 or match_hs_j2 or match_hs_j3 or match_hs_j4 or match_hs_j5:
-        cat = 'JF'
-        check += 1
-    
-    if match_hs_j6 or match_hs_j7 or match_hs_j8 or match_hs_j9 or match_hs_j10:
-        cat = 'JM'
-        check += 1
+    for segnale, categoria in ORDINE_CATEGORIE:
+        if segnale in segnali:
+            cat = categoria
+            if segnale not in ('SM', 'SF'):
+                check += 1
     
     if check > 1:
         print('Ho trovato '+str(check)+'categorie diverse. Restituisco la più giovane. Non fidarti di me!')
@@ -1001,17 +1253,10 @@ def info_ostacoli(nome):
         return spec, warn_spec
 
     # D'ora in poi possiamo assumere che 'nome' cominci con un numero
+    segnali = trova_segnali(_RE_OSTACOLI, nome)
 
     # esordienti
-    match_eso1 = re.search(r'esordienti', nome)     # esordienti
-    match_eso2 = re.search(r'\bef\d+', nome)        # EF8
-    match_eso3 = re.search(r'\bem\d+', nome)        # EM5
-    match_eso4 = re.search(r'\bef\b', nome)         # EF
-    match_eso5 = re.search(r'\bem\b', nome)         # EM
-    match_eso6 = re.search(r'\bef\w\b', nome)       # EFA
-    match_eso7 = re.search(r'\bem\w\b', nome)       # EMB
-    
-    if not(found) and (match_eso1 or match_eso2 or match_eso3 or match_eso4 or match_eso5 or match_eso6 or match_eso7):
+    if not(found) and 'E' in segnali:
         dist = re.search(r'\d+', nome)[0]
         spec = dist.strip()+' Hs Esordienti'
         found = True
@@ -1043,21 +1288,13 @@ def info_ostacoli(nome):
     # ora devo indentificare le categorie se voglio sapere l'altezza dell'ostacolo
     # ragazzi
     dist = re.search(r'\d+', nome)[0].strip()
-    match_hs_r0 = re.search(r'ragazz', nome)   # ragazz
-    match_hs_r1 = re.search(r'\brm\b', nome)   # rm
-    match_hs_r2 = re.search(r'\brf\b', nome)   # rf
     
-    if not(found) and (match_hs_r0 or match_hs_r1 or match_hs_r2):
+    if not(found) and 'R' in segnali:
         spec = dist+' Hs h60'
         found = True
         
     # cadetti e cadette
-    match_hs_c1 = re.search(r'cadetti', nome)  # cadetti
-    match_hs_c2 = re.search(r'\bcm\b', nome)   # cm
-    match_hs_c3 = re.search(r'cadette', nome)  # cadettte
-    match_hs_c4 = re.search(r'\bcf\b', nome)   # cf
-    
-    if not(found) and (match_hs_c1 or match_hs_c2):
+    if not(found) and 'CM' in segnali:
         if dist in ('60', '100'): h = '84'
         elif dist in ('200', '300'): h = '76'
         else:
@@ -1066,17 +1303,12 @@ def info_ostacoli(nome):
         spec = dist+' Hs h'+h
         found = True
 
-    if not(found) and (match_hs_c3 or match_hs_c4):
+    if not(found) and 'CF' in segnali:
         spec = dist+' Hs h76'
         found = True
         
     # allievi e allieve
-    match_hs_a1 = re.search(r'allievi', nome)  # allievi
-    match_hs_a2 = re.search(r'\bam\b', nome)   # am
-    match_hs_a3 = re.search(r'allieve', nome)  # allieve
-    match_hs_a4 = re.search(r'\baf\b', nome)   # af
-    
-    if not(found) and (match_hs_a1 or match_hs_a2):
+    if not(found) and 'AM' in segnali:
         if dist in ('60', '100'): h = '91'
         elif dist == '200': h = '76'
         elif dist == ('300', '400'): h = '84'
@@ -1086,23 +1318,12 @@ def info_ostacoli(nome):
         spec = dist+' Hs h'+h
         found = True
 
-    if not(found) and (match_hs_a3 or match_hs_a4):
+    if not(found) and 'AF' in segnali:
         spec = dist+' Hs h76'
         found = True
         
     # junior
-    match_hs_j1 = re.search(r'junior u', nome)     # junior u
-    match_hs_j2 = re.search(r'junior m', nome)     # junior m
-    match_hs_j3 = re.search(r'juniores u', nome)   # juniores u
-    match_hs_j4 = re.search(r'juniores m', nome)   # juniores m
-    match_hs_j5 = re.search(r'\bjm\b', nome)       # jm
-    match_hs_j6 = re.search(r'junior d', nome)     # junior d
-    match_hs_j7 = re.search(r'junior f', nome)     # junior f
-    match_hs_j8 = re.search(r'juniores d', nome)   # juniores d
-    match_hs_j9 = re.search(r'juniores f', nome)   # juniores f
-    match_hs_j10 = re.search(r'\bjf\b', nome)      # jf
-    
-    if not(found) and (match_hs_j1 or match_hs_j2 or match_hs_j3 or match_hs_j4 or match_hs_j5):
+    if not(found) and 'JM' in segnali:
         if dist in ('60', '110'): h = '100'
         elif dist == '200': h = '76'
         elif dist == ('300', '400'): h = '91'
@@ -1112,7 +1333,7 @@ def info_ostacoli(nome):
         spec = dist+' Hs h'+h
         found = True
     
-    if not(found) and (match_hs_j6 or match_hs_j7 or match_hs_j8 or match_hs_j9 or match_hs_j10):
+    if not(found) and 'JF' in segnali:
         if dist in ('60', '100'): h = '84'
         elif dist == '200': h = '76'
         elif dist == ('300', '400'): h = '76'
@@ -1123,18 +1344,7 @@ def info_ostacoli(nome):
         found = True
     
     # In teoria mi sono rimasti solo gli assoluti ora. Devo solo distinguere tra uomo e donna
-    match_hs_ass1 = re.search(r'uomini', nome)     # uomini
-    match_hs_ass2 = re.search(r'men', nome)        # men
-    match_hs_ass3 = re.search(r'maschil\w', nome)   # maschile
-    match_hs_ass4 = re.search(r'\bm\b', nome)      # m
-    match_hs_ass5 = re.search(r'\bu\b', nome)      # u
-    match_hs_ass6 = re.search(r'donne', nome)      # donne
-    match_hs_ass7 = re.search(r'women', nome)      # women
-    match_hs_ass8 = re.search(r'femminil\w', nome)  # maschile
-    match_hs_ass9 = re.search(r'\bf\b', nome)      # f
-    match_hs_ass10 = re.search(r'\bd\b', nome)     # d
-    
-    if not(found) and (match_hs_ass1 or match_hs_ass2 or match_hs_ass3 or match_hs_ass4 or match_hs_ass5):
+    if not(found) and 'SM' in segnali:
         if dist in ('60', '110'): h = '106'
         elif dist == '200': h = '76'
         elif dist == ('300', '400'): h = '91'
@@ -1145,7 +1355,7 @@ def info_ostacoli(nome):
         warn_spec = 'a esclusione'
         found = True
     
-    if not(found) and (match_hs_ass6 or match_hs_ass7 or match_hs_ass8 or match_hs_ass9 or match_hs_ass10):
+    if not(found) and 'SF' in segnali:
         if dist in ('60', '100'): h = '84'
         elif dist == '200': h = '76'
         elif dist == ('300', '400'): h = '76'
@@ -1394,6 +1604,255 @@ def assegna_evento_specifico(nome, eve):
     return spec, warn_spec
 
 
+def chiave_evento(nome, gara):
+    """
+    Tutto quello da cui dipende il risultato di assegna_evento_generale() e
+    assegna_evento_specifico(): il nome senza maiuscole e spazi ai lati e se
+    la pagina gara comincia con uno dei PREFISSI_GARA_ALTRO.
+    """
+    tipo_gara = next((p for p in PREFISSI_GARA_ALTRO if gara.startswith(p)), '')
+    return nome.strip().lower(), tipo_gara
+
+
+def classifica_evento(nome, gara):
+    """
+    assegna_evento_generale() + assegna_evento_specifico() su un evento: è
+    l'unico punto dove viene classificato un nome, tutto il resto passa da
+    qui (vedi _classifica_chiavi()). Il risultato dipende solo da
+    chiave_evento(nome, gara). Restituisce
+    (evento_gen, disciplina, warn_gen, warn_spec)
+    """
+    nome_norm, tipo_gara = chiave_evento(nome, gara)
+    evento_gen, warn_gen = assegna_evento_generale(nome_norm, tipo_gara)
+    disciplina, warn_spec = assegna_evento_specifico(nome_norm, evento_gen)
+
+    return evento_gen, disciplina, warn_gen, warn_spec
+
+
+def _classifica_chiavi(chiavi):
+    """
+    classifica_evento() su una lista di chiave_evento() distinte, senza
+    guardare la cache.
+    """
+    return [classifica_evento(nome, tipo_gara) for nome, tipo_gara in chiavi]
+
+
+def _aggiungi_a_cache(chiavi, risultati):
+    for chiave, risultato in zip(chiavi, risultati):
+        _CACHE_EVENTI[chiave] = risultato
+        _EVENTI_NUOVI.add(chiave)
+
+
+# Gruppi di regole della classificazione: per ogni gruppo le funzioni e le
+# tabelle da cui dipende e gli eventi generali a cui si applica (None = tutti).
+# Ci va solo il codice chiamato da classifica_evento(): cambiare qualcos'altro
+# non deve far partire una riclassificazione.
+# Se cambia qualcosa in un gruppo riclassifica_regole_cambiate() rifà solo le
+# righe di quegli eventi.
+GRUPPI_REGOLE = {
+    'generale':  ([chiave_evento, assegna_evento_generale, classifica_evento,
+                   PREFISSI_GARA_ALTRO], None),
+    'specifico': ([assegna_evento_specifico], None),
+    'ostacoli':  ([info_ostacoli, SEGNALI_OSTACOLI, _compila_segnali, trova_segnali],
+                  ['ostacoli']),
+    'master':    ([check_master, _RE_MASTER.pattern],
+                  ['ostacoli', 'marcia', 'disco', 'giavellotto', 'martello', 'peso']),
+}
+
+_versione_regole = None
+
+
+def versione_regole():
+    """
+    Impronta delle regole di classificazione: (versione, {gruppo: impronta}).
+    L'impronta di un gruppo è lo sha1 del codice delle sue funzioni e del
+    contenuto delle sue tabelle, la versione quello di tutti i gruppi.
+    """
+    global _versione_regole
+
+    if _versione_regole is None:
+        gruppi = {}
+        for gruppo, (oggetti, _) in GRUPPI_REGOLE.items():
+            sha = hashlib.sha1()
+            for oggetto in oggetti:
+                testo = inspect.getsource(oggetto) if callable(oggetto) else repr(oggetto)
+                sha.update(testo.encode())
+            gruppi[gruppo] = sha.hexdigest()[:12]
+        versione = hashlib.sha1(json.dumps(gruppi, sort_keys=True).encode()).hexdigest()[:12]
+        _versione_regole = (versione, gruppi)
+
+    return _versione_regole
+
+
+def registra_versione_regole(conn):
+    """Salva in versioni_regole la versione attuale delle regole."""
+    versione, gruppi = versione_regole()
+    conn.execute(text("""INSERT INTO versioni_regole (versione, gruppi)
+                         VALUES (:versione, :gruppi) ON CONFLICT DO NOTHING"""),
+                 {'versione': versione, 'gruppi': json.dumps(gruppi, sort_keys=True)})
+    conn.commit()
+
+
+def condizione_regole_vecchie(conn):
+    """
+    WHERE (senza WHERE) che seleziona le righe di pagine_gara o
+    eventi_classificati classificate con regole diverse da quelle attuali:
+    quelle senza versione o con una versione sconosciuta tutte, per le altre
+    solo quelle degli eventi generali toccati dai gruppi cambiati.
+    Restituisce anche le versioni vecchie ancora valide per le righe non
+    selezionate.
+    """
+    versione, gruppi = versione_regole()
+    df = pd.read_sql("SELECT versione, gruppi FROM versioni_regole", conn)
+
+    condizioni = ["versione_regole IS NULL"]
+    note = [versione]
+    invariate = []
+    for vecchia, gruppi_vecchi in zip(df['versione'], df['gruppi']):
+        if vecchia == versione:
+            continue
+        note.append(vecchia)
+
+        gruppi_vecchi = json.loads(gruppi_vecchi)
+        eventi = [GRUPPI_REGOLE[g][1] for g in gruppi if gruppi[g] != gruppi_vecchi.get(g)]
+        if any(e is None for e in eventi):
+            condizioni.append(f"versione_regole = '{vecchia}'")
+            continue
+
+        eventi = sorted({e for lista in eventi for e in lista})
+        if eventi:
+            lista = ', '.join(f"'{e}'" for e in eventi)
+            condizioni.append(f"(versione_regole = '{vecchia}' AND evento_gen IN ({lista}))")
+        invariate.append(vecchia)
+
+    lista = ', '.join(f"'{v}'" for v in note)
+    condizioni.append(f"versione_regole NOT IN ({lista})")
+
+    return ' OR '.join(condizioni), invariate
+
+
+def classifica_eventi(nomi, gare) -> pd.DataFrame:
+    """
+    classifica_evento() su due Series, con la cache: ogni chiave_evento() che
+    non è già nella cache viene classificata una volta sola. Restituisce un DataFrame con le colonne
+    evento_gen, disciplina, warn_gen e warn_spec.
+    """
+    chiavi = [chiave_evento(nome, gara) for nome, gara in zip(nomi, gare)]
+    nuove = list(dict.fromkeys(k for k in chiavi if k not in _CACHE_EVENTI))
+    _aggiungi_a_cache(nuove, _classifica_chiavi(nuove))
+
+    return pd.DataFrame([_CACHE_EVENTI[k] for k in chiavi], index=nomi.index,
+                        columns=['evento_gen', 'disciplina', 'warn_gen', 'warn_spec'])
+
+
+def carica_cache_eventi(conn):
+    """
+    Riempie la cache di classifica_eventi() con la tabella eventi_classificati
+    (solo i nomi classificati con la versione attuale delle regole). Quello
+    che c'era già in memoria viene buttato.
+    """
+    _CACHE_EVENTI.clear()
+    _EVENTI_NUOVI.clear()
+    df = pd.read_sql(text("SELECT * FROM eventi_classificati WHERE versione_regole = :versione"),
+                     conn, params={'versione': versione_regole()[0]})
+    for row in df.itertuples(index=False):
+        _CACHE_EVENTI[(row.nome, row.tipo_gara)] = (
+            row.evento_gen, row.disciplina, row.warn_gen, row.warn_spec)
+
+
+def salva_cache_eventi(conn):
+    """Salva in eventi_classificati i nomi classificati da questo processo."""
+    if not _EVENTI_NUOVI:
+        return 0
+
+    righe = [(nome, tipo_gara) + _CACHE_EVENTI[(nome, tipo_gara)]
+             for nome, tipo_gara in _EVENTI_NUOVI]
+    df = pd.DataFrame(righe, columns=['nome', 'tipo_gara', 'evento_gen',
+                                      'disciplina', 'warn_gen', 'warn_spec'])
+    df['versione_regole'] = versione_regole()[0]
+    # I nomi classificati con regole vecchie vengono sovrascritti
+    n_new = inserisci_righe(conn, 'eventi_classificati', df, ['nome', 'tipo_gara'],
+                            aggiorna=True)
+    conn.commit()
+    _EVENTI_NUOVI.clear()
+
+    return n_new
+
+
+def riclassifica_pagine_gara(engine, righe_blocco=20000):
+    """
+    Riclassifica tutte le pagine_gara del sigma vecchio e vecchissimo, da usare
+    quando cambiano le regole di classifica_evento(). Le righe arrivano dal
+    database a blocchi di righe_blocco, i nomi distinti che non sono ancora
+    stati classificati vengono classificati una volta sola e ogni blocco viene
+    riscritto con un solo UPDATE. Il tempo va quasi tutto in letture e
+    scritture sul database, non nella classificazione.
+    La cache in eventi_classificati viene rifatta da capo.
+    """
+    with engine.connect() as conn:
+        registra_versione_regole(conn)
+    query = text("""SELECT id, nome, gara FROM pagine_gara
+                    WHERE sigma IS DISTINCT FROM 'nuovo' ORDER BY id""")
+
+    # Le regole sono cambiate, quello che c'era in cache non vale più
+    _CACHE_EVENTI.clear()
+    _EVENTI_NUOVI.clear()
+
+    start = time.perf_counter()
+    tot = 0
+    with engine.connect() as lettura, engine.connect() as scrittura:
+        lettura = lettura.execution_options(stream_results=True,
+                                            max_row_buffer=righe_blocco)
+        for df in pd.read_sql_query(query, lettura, chunksize=righe_blocco):
+            df_classificate = classifica_eventi(df['nome'], df['gara']).replace('', None)
+            df_classificate.insert(0, 'id', df['id'].values)
+            df_classificate['versione_regole'] = versione_regole()[0]
+            aggiorna_righe(scrittura, 'pagine_gara', df_classificate, 'id')
+            scrittura.commit()
+
+            tot += len(df)
+            durata = time.perf_counter() - start
+            print(f"\t{tot} righe, {len(_CACHE_EVENTI)} nomi distinti, "
+                  f"{tot / max(durata, 1e-9):.0f} righe/s", end="\r")
+
+        scrittura.execute(text("DELETE FROM eventi_classificati"))
+        salva_cache_eventi(scrittura)
+
+    durata = time.perf_counter() - start
+    print(f"\nRiclassificate {tot} righe ({len(_CACHE_EVENTI)} nomi distinti) in {durata:.1f} s")
+
+
+def riclassifica_regole_cambiate(conn):
+    """
+    Riclassifica solo le pagine_gara (sigma vecchio e vecchissimo) che sono
+    state classificate con regole diverse da quelle attuali, vedi
+    condizione_regole_vecchie(). Le altre passano alla versione attuale.
+    """
+    registra_versione_regole(conn)
+    versione = versione_regole()[0]
+    condizione, invariate = condizione_regole_vecchie(conn)
+
+    # In eventi_classificati restano solo i nomi ancora validi
+    conn.execute(text(f"DELETE FROM eventi_classificati WHERE {condizione}"))
+    if invariate:
+        conn.execute(text("""UPDATE eventi_classificati SET versione_regole = :versione
+                             WHERE versione_regole = ANY(:invariate)"""),
+                     {'versione': versione, 'invariate': invariate})
+    conn.commit()
+
+    where_clause = f"WHERE sigma IS DISTINCT FROM 'nuovo' AND ({condizione})"
+    n = conn.execute(text(f"SELECT count(*) FROM pagine_gara {where_clause}")).scalar()
+    print(f"Regole {versione}: {n} righe da riclassificare")
+    if n:
+        assegna_evento(conn, 'custom', where_clause)
+
+    if invariate:
+        conn.execute(text("""UPDATE pagine_gara SET versione_regole = :versione
+                             WHERE versione_regole = ANY(:invariate)"""),
+                     {'versione': versione, 'invariate': invariate})
+        conn.commit()
+
+
 def assegna_evento_sigma_nuovo(row, conn):
     """
     Grazie ha dio il sigma nuovo ha la disciplina esatta nella pagina di 
@@ -1410,12 +1869,12 @@ def assegna_evento_sigma_nuovo(row, conn):
 
     url = f"{DOMAIN}{row['anno']}/{row['codice']}/Risultati/{gara}"
     try:
-        r = requests.get(url)
+        r = http_get_cache(url)
         if r.status_code != 200:
             print("Link rotto", url)
             return
         
-        soup = BeautifulSoup(r.text, 'html.parser')
+        soup = parse_html(r.text)
         div = soup.find('div', class_='col-md-4')
         p = div.find('p', class_='h4 text-danger mb-4 mt-4')
         span = p.find('span', class_='h7 text-danger')
@@ -1453,28 +1912,30 @@ def assegna_evento(conn, update_contidion, where_clause=''):
     df = pd.read_sql_query(query, conn)
     
     ## Nomi per sigma vecchio e vecchissimo
+    # Ogni nome distinto viene classificato una volta sola, i nomi già visti
+    # nelle esecuzioni precedenti sono nella tabella eventi_classificati
+    registra_versione_regole(conn)
+    carica_cache_eventi(conn)
     df_old = df[df['sigma'] != 'nuovo'].reset_index(drop=True)
     tot = len(df_old)
-    for ii, row in df_old.iterrows():
-        print(f"\t{ii:d}/{tot:d}", end="\r")
-        event_gen, warn_gen = assegna_evento_generale(row['nome'], row['gara'])
-        event_spec, warn_spec = assegna_evento_specifico(row['nome'], event_gen)
-        
-        update_query = text("""
-            UPDATE pagine_gara SET
-                disciplina = :disciplina,
-                warn_gen = :warn_gen,
-                warn_spec = :warn_spec
-            WHERE id = :id
-        """)
-        conn.execute(update_query, {
-            'disciplina': event_spec or None,
-            'warn_gen': warn_gen or None,
-            'warn_spec': warn_spec or None,
-            'id': row['id']
-        })
-    
+    start = time.perf_counter()
+    eventi = classifica_eventi(df_old['nome'], df_old['gara'])
+    durata = time.perf_counter() - start
+    print(f"Classificate {tot} righe in {durata:.1f} s "
+          f"({tot / max(durata, 1e-9):.0f} righe/s), "
+          f"{len(_EVENTI_NUOVI)} nomi nuovi")
+    salva_cache_eventi(conn)
+
+    # Scrive tutto con un solo UPDATE ... FROM
+    start = time.perf_counter()
+    df_classificate = eventi.replace('', None)
+    df_classificate.insert(0, 'id', df_old['id'])
+    df_classificate['versione_regole'] = versione_regole()[0]
+    aggiorna_righe(conn, 'pagine_gara', df_classificate, 'id')
     conn.commit()
+    durata = time.perf_counter() - start
+    print(f"Scritte {tot} righe in {durata:.1f} s "
+          f"({tot / max(durata, 1e-9):.0f} righe/s)")
 
     ## Nomi per sigma nuovo
     df_new = df[df['sigma'] == 'nuovo']
@@ -0,0 +1,168 @@
+import re
+import hashlib
+import pandas as pd
+from bs4 import BeautifulSoup, SoupStrainer, Tag
+
+# Tutte le pagine passano da parse_html(). Con lxml installato la lettura
+# dell'HTML è fatta in C, altrimenti si torna a html.parser che c'è sempre.
+# I tempi per le pagine di esempio sono in bench_parser.py.
+# Anche albero_html() e le funzioni che leggono le tabelle del sigma senza
+# BeautifulSoup (func_scrape) hanno bisogno di lxml: se manca CON_LXML è
+# False e si usano le versioni *_soup().
+try:
+    import lxml.html
+    PARSER_VELOCE = 'lxml'
+    CON_LXML = True
+except ImportError:
+    PARSER_VELOCE = 'html.parser'
+    CON_LXML = False
+
+# Le pagine del sigma vecchio e vecchissimo hanno HTML rotto (<tr> e <table>
+# non chiusi) e il codice che le legge conta su come html.parser lo ripara:
+# tabelle annidate, l'ordine di find_all('table'), ...
+# Per quelle pagine si usa sempre questo.
+PARSER_TOLLERANTE = 'html.parser'
+
+# Quello che serve delle pagine indice degli eventi (link_*() in func_general).
+# Passati come parse_only viene costruito solo l'albero di questi tag, il
+# resto della pagina viene letto e buttato
+SOLO_LINK_NUOVO = SoupStrainer('a', class_='link-style')
+SOLO_LINK_VECCHIO = SoupStrainer('td', id='idx_colonna1')
+SOLO_LINK_VECCHISSIMO = SoupStrainer('a', class_='idx_link')
+
+
+def parse_html(html, veloce=True, **kwargs) -> BeautifulSoup:
+    """
+    BeautifulSoup di html (str o bytes).
+    veloce=True  usa PARSER_VELOCE, per le pagine con HTML ben fatto (sito
+                 FIDAL e sigma nuovo)
+    veloce=False usa PARSER_TOLLERANTE, per le pagine del sigma vecchio e
+                 vecchissimo dove conta la struttura delle tabelle
+    Gli altri argomenti (per esempio parse_only) vanno a BeautifulSoup.
+    """
+    parser = PARSER_VELOCE if veloce else PARSER_TOLLERANTE
+    return BeautifulSoup(html, parser, **kwargs)
+
+
+# Come pd.read_html(): spazi e a capo dentro una cella diventano uno spazio
+_RE_SPAZI = re.compile(r"[\r\n]+|\s{2,}")
+# e le tabelle senza testo vengono saltate
+_RE_TESTO = re.compile(r".")
+
+
+def albero_html(html):
+    """
+    Albero lxml.html di html, senza passare da BeautifulSoup. Serve a chi
+    legge tabelle e intestazioni in un solo giro sul documento (vedi
+    tabella_html()). Per le pagine con HTML rotto conviene controllare il
+    risultato e tornare a parse_html(veloce=False) se non torna (vedi
+    tabelle_sigma_vecchio() in func_scrape).
+    Solo con CON_LXML.
+    """
+    return lxml.html.fromstring(html)
+
+
+def testo_html(el):
+    """Testo di un elemento di albero_html() o di un Tag di BeautifulSoup."""
+    return el.get_text() if isinstance(el, Tag) else el.text_content()
+
+
+def _testi(tabella):
+    return tabella.strings if isinstance(tabella, Tag) else tabella.itertext()
+
+
+# html.parser non chiude da solo <td> e <tr> (lxml sì, come i browser): una
+# cella non chiusa contiene le celle che seguono. Con BeautifulSoup righe,
+# celle e testo vengono quindi assegnati al <table>, <tr> o <td> più vicino
+# che li contiene, invece di prendere solo i figli diretti.
+
+def _righe(tabella):
+    # (intestazione, corpo): le <tr> del <thead> e le altre
+    if not isinstance(tabella, Tag):
+        return tabella.xpath('./thead/tr'), tabella.xpath('./tbody/tr|./tr')
+    intestazione, corpo = [], []
+    for tr in tabella.find_all('tr'):
+        if tr.find_parent('table') is tabella:
+            thead = tr.find_parent(['thead', 'table']).name == 'thead'
+            (intestazione if thead else corpo).append(tr)
+    return intestazione, corpo
+
+
+def _celle(tr):
+    if not isinstance(tr, Tag):
+        return tr.xpath('./td|./th')
+    return [c for c in tr.find_all(['td', 'th']) if c.find_parent('tr') is tr]
+
+
+def _intestazione(cella):
+    return (cella.name if isinstance(cella, Tag) else cella.tag) == 'th'
+
+
+def _testo_cella(cella):
+    if isinstance(cella, Tag):
+        testo = ''.join(t for t in cella.strings if t.find_parent(['td', 'th']) is cella)
+    else:
+        testo = cella.text_content()
+    return _RE_SPAZI.sub(" ", testo.strip())
+
+
+def tabella_html(tabella):
+    """
+    DataFrame della <table> tabella (elemento di albero_html() o Tag di
+    BeautifulSoup), letto come farebbe pd.read_html() con le pagine del
+    sigma nuovo:
+     - le righe del <thead> (o le prime righe fatte solo di <th>) sono
+       l'intestazione, se sono più di una conta l'ultima
+     - una cella con colspan viene ripetuta su tutte le colonne che copre
+       (al massimo fino alla larghezza dell'intestazione)
+     - le righe corte vengono completate con celle vuote e i tipi delle
+       colonne sono dedotti come in read_html() (celle vuote -> NaN)
+    Restituisce None se la tabella non ha testo o non ha righe.
+    """
+    if not any(_RE_TESTO.search(t) for t in _testi(tabella)):
+        return None
+
+    if isinstance(tabella, Tag):
+        for br in tabella.find_all('br'):
+            br.replace_with("\n")
+    else:
+        for br in tabella.iter('br'):
+            br.tail = "\n" + (br.tail or "")
+
+    intestazione, corpo = _righe(tabella)
+    if not intestazione:
+        while corpo and all(_intestazione(c) for c in _celle(corpo[0])):
+            intestazione.append(corpo.pop(0))
+
+    righe = []
+    for tr in intestazione[-1:] + corpo:
+        riga = []
+        for cella in _celle(tr):
+            testo = _testo_cella(cella)
+            try:
+                colspan = max(int(cella.get('colspan', 1)), 1)
+            except ValueError:
+                colspan = 1
+            riga.extend([testo] * colspan)
+        righe.append(riga)
+
+    if not righe:
+        return None
+
+    larghezza = len(righe[0]) if intestazione else max(len(r) for r in righe)
+    righe = [r[:larghezza] + [""] * (larghezza - len(r)) for r in righe]
+
+    try:
+        return pd.io.parsers.TextParser(righe, header=0 if intestazione else None,
+                                        thousands=',').read()
+    except pd.errors.EmptyDataError:
+        return None
+
+
+def impronta_tabella(tabella):
+    """
+    sha1 del testo della <table> tabella (come in tabella_html()). Costa
+    molto meno di tabella_html() e serve per sapere se una tabella è
+    cambiata senza leggerla.
+    """
+    return hashlib.sha1(''.join(_testi(tabella)).encode()).hexdigest()
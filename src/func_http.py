@@ -0,0 +1,303 @@
+import requests
+import time
+import os
+import re
+import json
+import hashlib
+from threading import Lock, get_ident
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+# Tutte le richieste a www.fidal.it passano da qui: una sola Session con le
+# connessioni tenute aperte (keep-alive) invece di una connessione TCP+TLS
+# nuova per ogni requests.get()
+
+# Connessioni aperte al massimo verso lo stesso host. Con pool_block=True i
+# thread in più aspettano che se ne liberi una invece di aprirne altre
+MAX_CONNESSIONI_HOST = 10
+
+# Secondi dopo cui una richiesta viene abbandonata
+TIMEOUT = 30
+
+# urllib3 decodifica le risposte brotli solo se è installato brotli/brotlicffi
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        ACCEPT_ENCODING = 'gzip, deflate, br'
+    except ImportError:
+        ACCEPT_ENCODING = 'gzip, deflate'
+
+# Cache su disco delle pagine del sigma, una coppia di file .json/.body per URL.
+# Non viene mai svuotata da sola: pulisci_cache_http() toglie le pagine non
+# usate da più di GIORNI_CACHE giorni
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cache_http')
+
+# Secondi per cui una pagina in cache viene usata senza chiedere nulla al
+# server. Passato questo tempo la pagina viene rivalidata con
+# If-None-Match/If-Modified-Since (la risposta 304 non ha contenuto).
+# Le pagine che non sono in questa lista vengono sempre rivalidate.
+TTL_PAGINE = [
+    (re.compile(r'/Index\.htm$'), 10 * 60),                             # home
+    (re.compile(r'/Index\w*PerGara\.html$'), 5 * 60),                   # indici nuovo
+    (re.compile(r'/(RESULTS|ENTRYLIST)BYEVENT\d+\.htm$', re.I), 5 * 60), # indici vecchio
+    (re.compile(r'/Gara\w*\.html?$'), 60),                              # gare
+]
+
+# Le pagine in cache non lette o salvate da più di questi giorni vengono
+# tolte da pulisci_cache_http()
+GIORNI_CACHE = 60
+
+# Numero di richieste, tempo totale e byte scaricati per metodo HTTP
+STATISTICHE_HTTP = {}
+
+# 'fresche':    servite dalla cache senza richieste
+# 'rivalidate': il server ha risposto 304, servite dalla cache
+# 'scaricate':  scaricate di nuovo (e salvate in cache)
+STATISTICHE_CACHE = {'fresche': 0, 'rivalidate': 0, 'scaricate': 0}
+
+_session = None
+_lock_session = Lock()
+_lock_statistiche = Lock()
+
+
+def get_session() -> requests.Session:
+    """Crea (una volta sola) e restituisce la Session condivisa."""
+    global _session
+
+    with _lock_session:
+        if _session is None:
+            adapter = HTTPAdapter(pool_connections=4,
+                                  pool_maxsize=MAX_CONNESSIONI_HOST,
+                                  pool_block=True)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({'Accept-Encoding': ACCEPT_ENCODING,
+                                    'Connection': 'keep-alive'})
+            _session = session
+
+    return _session
+
+
+def _registra(metodo, richieste=0, secondi=0.0, n_byte=0):
+    """Aggiunge a STATISTICHE_HTTP[metodo] richieste, secondi e byte."""
+    with _lock_statistiche:
+        stat = STATISTICHE_HTTP.setdefault(metodo, {'richieste': 0,
+                                                    'secondi': 0.0,
+                                                    'byte': 0})
+        stat['richieste'] += richieste
+        stat['secondi'] += secondi
+        stat['byte'] += n_byte
+
+
+def _conta_byte_letti(metodo, response):
+    # Con stream=True il contenuto viene scaricato solo quando viene letto
+    # (.content, .text e iter_content() passano tutti da iter_content()):
+    # i byte si contano in quel momento, e non si contano se non viene letto
+    iter_content = response.iter_content
+
+    def iter_content_contato(*args, **kwargs):
+        for blocco in iter_content(*args, **kwargs):
+            _registra(metodo, n_byte=len(blocco))
+            yield blocco
+
+    response.iter_content = iter_content_contato
+
+
+def http_request(metodo, url, **kwargs) -> requests.Response:
+    """Fa una richiesta con la Session condivisa e ne registra la durata."""
+    kwargs.setdefault('timeout', TIMEOUT)
+
+    start = time.perf_counter()
+    response = get_session().request(metodo, url, **kwargs)
+    secondi = time.perf_counter() - start
+
+    if kwargs.get('stream', False):
+        _registra(metodo, richieste=1, secondi=secondi)
+        _conta_byte_letti(metodo, response)
+    else:
+        _registra(metodo, richieste=1, secondi=secondi, n_byte=len(response.content))
+
+    return response
+
+
+def http_get(url, **kwargs) -> requests.Response:
+    """Come requests.get(), ma con la Session condivisa."""
+    return http_request('GET', url, **kwargs)
+
+
+def http_head(url, **kwargs) -> requests.Response:
+    """Come requests.head(), ma con la Session condivisa."""
+    return http_request('HEAD', url, **kwargs)
+
+
+def ttl_pagina(url):
+    """Secondi per cui la pagina url in cache è considerata aggiornata."""
+    for pattern, ttl in TTL_PAGINE:
+        if pattern.search(url):
+            return ttl
+    return 0
+
+
+def _file_cache(url):
+    chiave = hashlib.sha1(url.encode()).hexdigest()
+    return (os.path.join(CACHE_DIR, chiave + '.json'),
+            os.path.join(CACHE_DIR, chiave + '.body'))
+
+
+def _scrivi_file(path, contenuto: bytes):
+    """Scrittura atomica, più thread possono salvare la stessa pagina."""
+    tmp = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(contenuto)
+    os.replace(tmp, path)
+
+
+def _leggi_cache(url):
+    """Restituisce (meta, contenuto) della pagina in cache o (None, None)."""
+    file_meta, file_body = _file_cache(url)
+    try:
+        with open(file_meta, 'r') as f:
+            meta = json.load(f)
+        with open(file_body, 'rb') as f:
+            body = f.read()
+    except (OSError, ValueError):
+        return None, None
+
+    return meta, body
+
+
+def _tocca(url):
+    """Aggiorna la data del .body di una pagina letta dalla cache, per pulisci_cache_http()."""
+    try:
+        os.utime(_file_cache(url)[1])
+    except OSError:
+        pass
+
+
+def _salva_cache(url, response):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    file_meta, file_body = _file_cache(url)
+    meta = {
+        'url': url,
+        'salvato': time.time(),
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'encoding': response.encoding,
+        'headers': dict(response.headers),
+    }
+    _scrivi_file(file_body, response.content)
+    _scrivi_file(file_meta, json.dumps(meta).encode())
+
+
+def _risposta_da_cache(url, meta, body) -> requests.Response:
+    """Ricostruisce una requests.Response con la pagina salvata."""
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response._content = body
+    response.encoding = meta['encoding']
+    response.headers = CaseInsensitiveDict(meta['headers'])
+    return response
+
+
+def http_get_cache(url, stabile_dal=None, **kwargs) -> requests.Response:
+    """
+    Come http_get(), ma passando dalla cache su disco.
+     - Se la pagina è in cache da meno di ttl_pagina(url) secondi, oppure se
+       è stata salvata dopo stabile_dal (timestamp da cui la pagina non cambia
+       più, vedi gara_stabile_dal() in func_general), non viene fatta
+       nessuna richiesta.
+     - Altrimenti viene fatta una GET condizionale con l'ETag/Last-Modified
+       salvati: se il server risponde 304 si usa la pagina in cache.
+    Vengono salvate solo le risposte 200.
+    """
+    meta, body = _leggi_cache(url)
+
+    if meta is not None:
+        stabile = stabile_dal is not None and meta['salvato'] >= stabile_dal
+        if stabile or time.time() - meta['salvato'] < ttl_pagina(url):
+            with _lock_statistiche:
+                STATISTICHE_CACHE['fresche'] += 1
+            _tocca(url)
+            return _risposta_da_cache(url, meta, body)
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if meta['etag']:
+            headers['If-None-Match'] = meta['etag']
+        if meta['last_modified']:
+            headers['If-Modified-Since'] = meta['last_modified']
+        kwargs['headers'] = headers
+
+    response = http_get(url, **kwargs)
+
+    if response.status_code == 304 and meta is not None:
+        meta['salvato'] = time.time()
+        _scrivi_file(_file_cache(url)[0], json.dumps(meta).encode())
+        _tocca(url)
+        with _lock_statistiche:
+            STATISTICHE_CACHE['rivalidate'] += 1
+        return _risposta_da_cache(url, meta, body)
+
+    if response.status_code == 200:
+        _salva_cache(url, response)
+        with _lock_statistiche:
+            STATISTICHE_CACHE['scaricate'] += 1
+
+    return response
+
+
+def pulisci_cache_http(giorni=GIORNI_CACHE) -> int:
+    """
+    Toglie da CACHE_DIR le pagine non lette né salvate da più di giorni
+    giorni (e i file temporanei rimasti da scritture interrotte).
+    Restituisce il numero di file tolti.
+    """
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+
+    limite = time.time() - giorni * 24 * 3600
+    tolti = 0
+    for nome in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, nome)
+        if nome.endswith('.json'):
+            # si guarda il .body, che viene toccato a ogni lettura
+            path_body = path[:-len('.json')] + '.body'
+            vecchio = not os.path.exists(path_body) or os.path.getmtime(path_body) < limite
+        else:
+            vecchio = os.path.getmtime(path) < limite
+        if vecchio:
+            try:
+                os.remove(path)
+                tolti += 1
+            except OSError:
+                pass
+    return tolti
+
+
+def azzera_statistiche_http():
+    with _lock_statistiche:
+        STATISTICHE_HTTP.clear()
+        for k in STATISTICHE_CACHE:
+            STATISTICHE_CACHE[k] = 0
+
+
+def stampa_statistiche_http():
+    """Riassunto delle richieste fatte: numero, tempo medio e MB scaricati."""
+    if not STATISTICHE_HTTP:
+        print("Nessuna richiesta HTTP")
+        return
+
+    for metodo, stat in sorted(STATISTICHE_HTTP.items()):
+        media = stat['secondi'] / stat['richieste'] * 1000
+        print(f"{metodo:5s} {stat['richieste']:6d} richieste, "
+              f"{media:7.1f} ms in media, "
+              f"{stat['byte'] / 1e6:.2f} MB")
+
+    if any(STATISTICHE_CACHE.values()):
+        print(f"Cache: {STATISTICHE_CACHE['fresche']} fresche, "
+              f"{STATISTICHE_CACHE['rivalidate']} rivalidate (304), "
+              f"{STATISTICHE_CACHE['scaricate']} scaricate")
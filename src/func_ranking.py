@@ -0,0 +1,114 @@
+import pandas as pd
+from sqlalchemy import text
+from func_db import crea_tabella_temporanea
+
+# Le classifiche sono nella tabella classifiche: per ogni (disciplina,
+# categoria, stagione) il miglior risultato di ogni atleta. Vengono
+# aggiornate da risultati_per_evento() con i risultati appena caricati
+# (id di risultati più alto di prima), nella stessa transazione, e solo
+# nelle partizioni dove c'è qualcosa di nuovo.
+# Le prime N di una classifica si leggono dall'indice classifiche_ordine.
+
+CHIAVE_CLASSIFICA = ['disciplina', 'categoria', 'stagione', 'atleta']
+
+# Stato di una prestazione (colonna Stato di codifica_prestazioni()), a
+# partire da quello che restituisce clean_tempo() in func_scrape
+STATO_VALIDA = 0
+STATI_PRESTAZIONE = {'DNF': 1, 'DNS': 2, 'NM': 3, 'DSQ': 4, 'boh': 9}
+
+
+def tipo_misura(disciplina):
+    """'tempo' per corse e marcia (stesso controllo di batterie_*_corse()), 'punti' per le prove multiple, 'misura' per salti e lanci."""
+    if disciplina[:1].isdigit() or disciplina.startswith('Marcia'):
+        return 'tempo'
+    if 'athlon' in disciplina.lower():
+        return 'punti'
+    return 'misura'
+
+
+def ultimo_risultato(conn) -> int:
+    """id più alto della tabella risultati (0 se è vuota)."""
+    return conn.execute(text("SELECT coalesce(max(id), 0) FROM risultati")).scalar()
+
+
+def migliori_per_atleta(df) -> pd.DataFrame:
+    """
+    Da una DataFrame di righe della tabella risultati tiene il miglior
+    risultato valido di ogni atleta per (disciplina, categoria, stagione).
+    La stagione è l'anno della data del risultato. ordine è valore per le
+    corse (vince il tempo più basso) e -valore per salti, lanci e prove
+    multiple, così in tutte le classifiche il migliore ha l'ordine più basso.
+    """
+    df = df[(df['stato'] == STATO_VALIDA) & df['valore'].notna()
+            & df['data'].notna() & df['categoria'].notna()].copy()
+
+    # read_sql() legge valore come float se ci sono NULL
+    df['valore'] = df['valore'].astype('int64')
+    df['stagione'] = pd.to_datetime(df['data']).dt.year
+    segno = df['disciplina'].map({d: 1 if tipo_misura(d) == 'tempo' else -1
+                                  for d in df['disciplina'].unique()})
+    df['ordine'] = df['valore'] * segno
+    df = df.rename(columns={'id': 'risultato'})
+
+    df = df.sort_values('ordine', kind='stable').drop_duplicates(subset=CHIAVE_CLASSIFICA)
+    return df[CHIAVE_CLASSIFICA + ['anno', 'club', 'prestazione', 'valore', 'ordine',
+                                   'data', 'luogo', 'risultato']]
+
+
+def aggiorna_classifiche(conn, dopo_id=0, pagina_gara=None) -> int:
+    """
+    Aggiorna la tabella classifiche con i risultati con id > dopo_id (di
+    solito ultimo_risultato() letto prima di caricare i risultati nuovi),
+    solo quelli della pagina pagina_gara (id di pagine_gara) se è data.
+    Un atleta già in classifica viene sovrascritto solo se il risultato
+    nuovo è migliore. Non fa commit.
+
+    Restituisce il numero di righe di classifiche aggiunte o cambiate.
+    """
+    query = text("""SELECT id, disciplina, categoria, atleta, anno, club, prestazione,
+                           valore, stato, data, luogo
+                    FROM risultati WHERE id > :dopo_id
+                    AND (CAST(:pagina_gara AS INTEGER) IS NULL OR pagina_gara = :pagina_gara)""")
+    df = pd.read_sql(query, conn, params={'dopo_id': int(dopo_id),
+                                          'pagina_gara': None if pagina_gara is None else int(pagina_gara)})
+    migliori = migliori_per_atleta(df)
+    if migliori.empty:
+        return 0
+
+    tmp = 'tmp_classifiche'
+    crea_tabella_temporanea(conn, tmp, 'classifiche', migliori)
+
+    colonne = ', '.join(migliori.columns)
+    altre = [c for c in migliori.columns if c not in CHIAVE_CLASSIFICA]
+    result = conn.execute(text(f"""
+        INSERT INTO classifiche ({colonne})
+        SELECT {colonne} FROM {tmp}
+        ON CONFLICT ({', '.join(CHIAVE_CLASSIFICA)}) DO UPDATE
+        SET {', '.join(f'{c} = EXCLUDED.{c}' for c in altre)}
+        WHERE EXCLUDED.ordine < classifiche.ordine
+    """))
+    conn.execute(text(f"DROP TABLE {tmp}"))
+
+    return result.rowcount
+
+
+def ricostruisci_classifiche(conn) -> int:
+    """Svuota classifiche e la ricostruisce da tutta la tabella risultati. Fa commit."""
+    conn.execute(text("TRUNCATE classifiche"))
+    n = aggiorna_classifiche(conn)
+    conn.commit()
+    return n
+
+
+def classifica(conn, disciplina, categoria, stagione, n=20) -> pd.DataFrame:
+    """Prime n posizioni della classifica (disciplina, categoria, stagione)."""
+    query = text("""SELECT atleta, anno, club, prestazione, data, luogo
+                    FROM classifiche
+                    WHERE disciplina = :disciplina AND categoria = :categoria
+                    AND stagione = :stagione
+                    ORDER BY ordine
+                    LIMIT :n""")
+    df = pd.read_sql(query, conn, params={'disciplina': disciplina, 'categoria': categoria,
+                                          'stagione': int(stagione), 'n': int(n)})
+    df.index = range(1, len(df) + 1)
+    return df
@@ -1,10 +1,17 @@
-import requests
 from datetime import timedelta, datetime
 import pandas as pd
 import re
-from bs4 import BeautifulSoup
+from itertools import islice
 from datetime import datetime
 from func_general import DOMAIN
+from func_http import http_get, http_get_cache
+from func_html import (parse_html, albero_html, tabella_html, impronta_tabella,
+                       testo_html, CON_LXML)
+if CON_LXML:
+    from lxml import etree
+from func_db import copia_in_tabella, inserisci_righe
+from func_ranking import (tipo_misura, STATO_VALIDA, STATI_PRESTAZIONE,
+                          ultimo_risultato, aggiorna_classifiche)
 from sqlalchemy import text
 from io import StringIO
 
@@ -71,13 +78,13 @@ def iscritti_sigma_nuovo(anno, codice, gara) -> pd.DataFrame | None:
     """
     # Richiesta
     url = f"{DOMAIN}{anno}/{codice}/Iscrizioni/{gara}"
-    r = requests.get(url)
+    r = http_get(url)
     if r.status_code != 200:
         print("\nPagina non esistente", url)
         return None 
 
     # Trova la tabella
-    soup = BeautifulSoup(r.text, "html.parser")
+    soup = parse_html(r.text)
     tables = soup.find_all('table', {'class': 'table table-striped table-sm table-bordered h6-7'})
     if len(tables) != 1:
         print(f"\nHo {len(tables)} tabelle: {url}")
@@ -135,13 +142,13 @@ def iscritti_sigma_vecchio(anno, codice, gara, sigma) -> pd.DataFrame | None:
 
     # Richiesta
     url = f"{DOMAIN}{anno}/{codice}/{gara}"
-    r = requests.get(url)
+    r = http_get(url)
     if r.status_code != 200:
         print("\nPagina non esistente", url)
         return None 
 
     # Trova la tabella giusta in base al sigma
-    soup = BeautifulSoup(r.text, "html.parser")
+    soup = parse_html(r.text, veloce=False)
     tables = soup.find_all('table')
 
     if sigma == 'vecchio':
@@ -341,41 +348,231 @@ def get_iscritti(conn, update_condition, where_clause=''):
         ).sum()
 
 
-def cerca_risultati_gara(row, conn):
+# Da COLONNE_RISULTATI (scrape_*_corse()) alle colonne della tabella risultati
+COLONNE_TABELLA_RISULTATI = {'Disciplina': 'disciplina', 'Prestazione': 'prestazione',
+                             'Atleta': 'atleta', 'Anno': 'anno',
+                             'Categoria': 'categoria', 'Società': 'club',
+                             'Data': 'data', 'Luogo': 'luogo', 'Gara': 'link',
+                             'Batteria': 'batteria'}
 
-    # Le informazioni più importanti che abbiamo per identificare la gara
-    # sono 'data_inizio', 'data_fine' e 'luogo' in row
 
-    query = text("""
-            SELECT * FROM results
-            WHERE data BETWEEN :inizio AND :fine
-            AND :luogo LIKE '%' || luogo || '%'
-            """)
-    df = pd.read_sql(query, conn, params={'inizio': row['data_inizio'],
-                                          'fine': row['data_fine'],
-                                          'luogo': row['luogo'].replace('--','').strip()})
-    print(row)
-    print(df)
-    exit()
+def inserisci_risultati(conn, pagina_gara, df) -> int:
+    """
+    Carica nella tabella risultati i risultati df (come restituiti da
+    scrape_*_corse()) della riga pagina_gara (id) di pagine_gara, con la
+    prestazione anche in numeri (valore e stato, vedi codifica_prestazioni()).
+    Le righe con (atleta, batteria, data) già presenti per quella pagina
+    vengono saltate, le altre vengono caricate con un solo COPY. La batteria
+    serve perché senza l'ora nel titolo batteria e finale dello stesso
+    atleta hanno la stessa data. Aggiorna
+    pagine_gara.scraped_ris anche se non c'è niente di nuovo.
+    Non fa commit.
+
+    Restituisce il numero di risultati aggiunti.
+    """
+    df = df.rename(columns=COLONNE_TABELLA_RISULTATI)[list(COLONNE_TABELLA_RISULTATI.values())]
+    df['data'] = pd.to_datetime(df['data'], errors='coerce')
+    # read_html() legge gli anni come float se nella colonna c'è una cella vuota
+    df['anno'] = df['anno'].map(lambda a: a if pd.isna(a) or isinstance(a, str) else str(int(a)))
+    df = df.drop_duplicates(subset=['atleta', 'batteria', 'data'])
+    codifica = codifica_prestazioni(df['prestazione'], df['disciplina'])
+    df['valore'] = codifica['Valore']
+    df['stato'] = codifica['Stato']
+
+    query = text("SELECT atleta, batteria, data FROM risultati WHERE pagina_gara = :id")
+    df_old = pd.read_sql(query, conn, params={'id': int(pagina_gara)})
+    df_old['data'] = pd.to_datetime(df_old['data'])
+
+    # NaT == NaT per merge(), quindi anche i risultati senza data non vengono
+    # caricati due volte. Le righe caricate prima della colonna batteria
+    # (batteria NULL) si confrontano solo con (atleta, data)
+    df_new = df
+    senza_batteria = df_old['batteria'].isna()
+    for chiave, old in [(['atleta', 'batteria', 'data'], df_old[~senza_batteria]),
+                        (['atleta', 'data'], df_old[senza_batteria])]:
+        df_new = df_new.merge(old[chiave].drop_duplicates(), on=chiave, how='left', indicator=True)
+        df_new = df_new[df_new['_merge'] == 'left_only'].drop(columns='_merge')
+    df_new.insert(0, 'pagina_gara', int(pagina_gara))
+
+    if not df_new.empty:
+        copia_in_tabella(conn, df_new, 'risultati')
+
+    conn.execute(text("UPDATE pagine_gara SET scraped_ris = CURRENT_TIMESTAMP WHERE id = :id"),
+                 {'id': int(pagina_gara)})
+
+    return len(df_new)
+
+
+def leggi_batterie_acquisite(conn, pagina_gara) -> dict:
+    """{titolo: impronta} delle batterie già caricate per la riga pagina_gara (id) di pagine_gara."""
+    query = text("SELECT titolo, impronta FROM batterie_acquisite WHERE pagina_gara = :id")
+    return dict(conn.execute(query, {'id': int(pagina_gara)}).fetchall())
+
+
+def salva_batterie_acquisite(conn, pagina_gara, acquisite, prima) -> int:
+    """
+    Salva in batterie_acquisite le batterie di acquisite (dict aggiornato da
+    batterie_sigma_nuovo()) nuove o cambiate rispetto a prima. Non fa commit.
+    """
+    nuove = {k: v for k, v in acquisite.items() if prima.get(k) != v}
+    df = pd.DataFrame({'pagina_gara': int(pagina_gara),
+                       'titolo': list(nuove.keys()),
+                       'impronta': list(nuove.values())})
+    return inserisci_righe(conn, 'batterie_acquisite', df, ['pagina_gara', 'titolo'],
+                           aggiorna=True)
+
+
+def risultati_per_evento(row, conn):
+    """
+    Scarica i risultati della pagina row (riga di pagine_gara con id, anno,
+    codice, gara, sigma, disciplina) e aggiunge quelli nuovi alla tabella
+    risultati con inserisci_risultati().
+    Per il sigma nuovo vengono lette solo le batterie nuove o cambiate
+    dall'ultima volta (tabella batterie_acquisite), così ricontrollare una
+    pagina con tante batterie mentre la gara è in corso costa poco.
+
+    Restituisce il numero di risultati aggiunti.
+    """
+    if row['sigma'] == 'nuovo':
+        url = f"{DOMAIN}{row['anno']}/{row['codice']}/Risultati/{row['gara']}"
+    else:
+        url = f"{DOMAIN}{row['anno']}/{row['codice']}/{row['gara']}"
+
+    competition_row = {'Versione Sigma': row['sigma'].capitalize(),
+                       'Disciplina': row['disciplina'],
+                       'Link': url}
+
+    try:
+        if row['sigma'] == 'nuovo':
+            acquisite = leggi_batterie_acquisite(conn, row['id'])
+            prima = dict(acquisite)
+            df = scrape_nuovo_corse(competition_row, acquisite)
+            salva_batterie_acquisite(conn, row['id'], acquisite, prima)
+        else:
+            df = scrape_vecchio_corse(competition_row)
+        ultimo = ultimo_risultato(conn)
+        n = inserisci_risultati(conn, row['id'], df)
+        # Classifiche nella stessa transazione dei risultati: se lo scraping
+        # si ferma a metà, quello che è già in risultati è anche in classifiche
+        aggiorna_classifiche(conn, ultimo, row['id'])
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"\nError: {e}")
+        print(f"URL: {url}")
+        return 0
+
+    return n
+
+
+def get_risultati(conn, update_condition, where_clause=''):
+    """
+    Scarica i risultati delle corse individuali e della marcia (le uniche che
+    scrape_*_corse() sanno leggere) delle gare in corso e li carica nella
+    tabella risultati.
+
+    Parametri:
+        conn: Connessione al database.
+        update_condition:
+            'date_N'   gare in corso o finite da al massimo N giorni
+            'scrape_N' gare in corso oggi, pagine non controllate da più di N
+                       minuti (per gli aggiornamenti in diretta)
+            'custom'   usa where_clause
+        where_clause (str): Clausola WHERE SQL su pagine_gara (p) e gare (g).
+
+    Restituisce:
+        int: Numero di risultati aggiunti al database.
+    """
+
+    todayis = datetime.today().date()
+
+    if update_condition.startswith('date_'):
+        N = int(update_condition.split('_')[1])
+        print(f"Controllo le gare finite da al massimo {N} giorni")
+
+        start_date = todayis - timedelta(days=N)
+        where_clause = f""" WHERE
+            g.data_inizio <= DATE '{todayis}'
+            AND g.data_fine >= DATE '{start_date}'
+        """
+
+    elif update_condition.startswith('scrape_'):
+        minutes = int(update_condition.split('_')[1])
+        print(f"Controllo le pagine non controllate da più di {minutes} minuti")
+
+        where_clause = f""" WHERE
+            DATE '{todayis}' BETWEEN g.data_inizio AND g.data_fine
+            AND (
+                p.scraped_ris IS NULL OR
+                p.scraped_ris < (CURRENT_TIMESTAMP - INTERVAL '{minutes} minutes')
+            )
+        """
+
+    elif update_condition == 'custom':
+        if where_clause == '':
+            print("where_clause vuota")
+            return 0
+        print("Uso:", where_clause)
+
+    else:
+        print("update_condition deve essere date_N, scrape_N o custom. "
+              f"update_condition = {update_condition}")
+        return 0
+
+    # Solo le pagine dei risultati (Gara001.htm, ..., non GaraL* e Staff*
+    # che sono le liste iscritti) di corse individuali e marcia
+    query = text(f"""
+        SELECT p.id, p.anno, p.codice, p.gara, p.sigma, p.disciplina
+        FROM pagine_gara p JOIN gare g ON g.codice = p.codice
+        {where_clause}
+        AND p.sigma IN ('nuovo', 'vecchio')
+        AND p.gara ~ '^Gara[0-9]'
+        AND (p.disciplina ~ '^[0-9]' OR p.disciplina LIKE 'Marcia%')
+        AND p.disciplina NOT LIKE '%x%'
+    """)
+    df_pagine = pd.read_sql(query, conn)
+
+    added = 0
+    tot = len(df_pagine)
+    for ii, row in df_pagine.iterrows():
+        print(f"\t{ii:d}/{tot:d}", end="\r")
+        added += risultati_per_evento(row, conn)
+
+    print(f"Aggiunti {added} risultati da {tot} pagine")
+    return added
+
+
+# Frazione minima di iscritti con un risultato in results per dire che i
+# risultati della gara sono nel DB FIDAL
+SOGLIA_IN_DB = 0.2
+
+
+def chiave_luogo(colonna):
+    """
+    Espressione SQL con il luogo in colonna normalizzato per i confronti:
+    minuscolo e solo lettere e numeri ('Roma -- Stadio' -> 'romastadio').
+    """
+    return f"lower(regexp_replace(coalesce({colonna}, ''), '[^[:alnum:]]', '', 'g'))"
 
 
 def gare_in_DB(conn, update_condition, where_clause=''):
     """
-    Controlla se almeno il 20% degli iscritti a una gara ha risultati
+    Controlla se almeno SOGLIA_IN_DB degli iscritti a una gara ha risultati
     all'interno della tabella results del DB per inferire se i risultati della
     gara sono stati inviati e inseriti nel DB FIDAL.
     (Questo mi permette di togliere l'iscrizione dal profilo di un atleta poiché
     comparirà già il risultato)
-    Probabilmente si può fare una grossa query direttamente in SQL che controlla
-    tutte le cose in parallelo unendo le colonne delle tabelle, ma sinceramente
-    non ne ho le competenze e credo che salteranno fuori così tante cose strane
-    che tanto vale andarci con i piedi di piompo e usare pandas.
+    Tutto in una query: gli iscritti di tutte le gare da controllare vengono
+    uniti a results per atleta e date della gara (indice results_atleta_data),
+    il luogo del risultato deve essere contenuto in quello della gara (se la
+    gara ce l'ha). Le gare sopra la soglia vengono segnate con in_db in un
+    solo UPDATE.
 
     Parametri:
         conn: Connessione al database.
 
     Restituisce:
-        None
+        int: Numero di gare segnate con in_db.
     """
 
     todayis = datetime.today().date()
@@ -394,20 +591,48 @@ def gare_in_DB(conn, update_condition, where_clause=''):
     elif update_condition == 'custom':
         if where_clause == '':
             print("where_clause vuota")
-            return
+            return 0
         print("Uso:", where_clause)
 
     else:
         print("update_condition deve essere date_N dove N è il numero di giorni"
               "passati dalla fine di una gara."
               f"update_condition = {update_condition}")
-        return
+        return 0
 
-    query = f"SELECT * FROM gare {where_clause}"
-    df = pd.read_sql(query, conn)
+    query = text(f"""
+        WITH candidate AS (
+            SELECT codice, data_inizio, data_fine, {chiave_luogo('luogo')} AS luogo
+            FROM gare {where_clause}
+        ),
+        iscritti_gara AS (
+            SELECT DISTINCT c.codice, lower(i.atleta) AS atleta
+            FROM iscritti i JOIN candidate c ON c.codice = i.codice
+        ),
+        copertura AS (
+            SELECT ig.codice,
+                   count(*) AS iscritti,
+                   count(*) FILTER (WHERE EXISTS (
+                       SELECT 1 FROM results r
+                       WHERE lower(r.atleta) = ig.atleta
+                       AND r.data BETWEEN c.data_inizio AND c.data_fine
+                       AND (c.luogo = ''
+                            OR ({chiave_luogo('r.luogo')} <> ''
+                                AND strpos(c.luogo, {chiave_luogo('r.luogo')}) > 0))
+                   )) AS trovati
+            FROM iscritti_gara ig JOIN candidate c ON c.codice = ig.codice
+            GROUP BY ig.codice
+        )
+        UPDATE gare g SET in_db = true
+        FROM copertura k
+        WHERE g.codice = k.codice
+        AND k.trovati >= :soglia * k.iscritti
+    """)
+    n = conn.execute(query, {'soglia': SOGLIA_IN_DB}).rowcount
+    conn.commit()
 
-    for i, row in df.iterrows():
-        cerca_risultati_gara(row, conn)
+    print(f"{n} gare hanno i risultati nel DB")
+    return n
 
 
 
@@ -479,6 +704,66 @@ def clean_tempo(tempo):
     else: return 'boh'
 
 
+def _centesimi(tempi):
+    """
+    Serie di tempi come li restituisce clean_tempo() ('7.67', '1:58.32',
+    '1:29:12') in centesimi di secondo. I millesimi vengono arrotondati al
+    centesimo superiore. NaN se il tempo non si legge.
+    Tre numeri separati da punti sono ore, minuti e secondi come si scrivono
+    nelle corse su strada ('2.10.00' è 2:10:00, non 2:10.00).
+
+    >>> _centesimi(pd.Series(['7.67', '7.671', '1:58.32', '1:29:12', '2.10.00', 'boh'])).tolist()
+    [767.0, 768.0, 11832.0, 535200.0, 780000.0, nan]
+    """
+    tempi = tempi.str.replace(r'^(\d+)\.(\d+)\.(\d+)$', r'\1:\2:\3', regex=True)
+    parti = tempi.str.extract(r'^(?:(?:(\d+):)?(\d+):)?(\d+)(?:\.(\d+))?$')
+
+    ore = pd.to_numeric(parti[0]).fillna(0)
+    minuti = pd.to_numeric(parti[1]).fillna(0)
+    secondi = pd.to_numeric(parti[2])
+    millesimi = pd.to_numeric(parti[3].fillna('').str.ljust(3, '0').str[:3])
+
+    return ((ore * 60 + minuti) * 60 + secondi) * 100 + (millesimi + 9) // 10
+
+
+def codifica_prestazioni(prestazioni, discipline) -> pd.DataFrame:
+    """
+    Versione numerica di una colonna di prestazioni uscite da clean_tempo(),
+    per poterle ordinare senza rileggere le stringhe.
+    discipline è la disciplina di ogni prestazione (serie) o di tutte (str).
+
+    Restituisce una DataFrame con lo stesso indice e colonne
+        Valore: centesimi di secondo per corse e marcia, millimetri per salti
+                e lanci, punti per le prove multiple (<NA> se non c'è)
+        Stato:  STATO_VALIDA o uno di STATI_PRESTAZIONE (DNF, DNS, NM, DSQ e
+                'boh' per le prestazioni che non si riescono a leggere)
+    """
+    prestazioni = pd.Series(prestazioni).astype(str)
+    if isinstance(discipline, pd.Series):
+        discipline = discipline.reindex(prestazioni.index).fillna('').astype(str)
+    else:
+        discipline = pd.Series(discipline, index=prestazioni.index).astype(str)
+
+    tipo = discipline.map({d: tipo_misura(d) for d in discipline.unique()})
+    corsa = tipo == 'tempo'
+    misura = tipo == 'misura'
+    multiple = tipo == 'punti'
+
+    valore = pd.Series(pd.NA, index=prestazioni.index, dtype='Float64')
+    # I tempi si ripetono molto, vengono letti una volta sola
+    tempi = pd.Series(prestazioni[corsa].unique())
+    valore[corsa] = prestazioni[corsa].map(pd.Series(_centesimi(tempi).to_numpy(), index=tempi))
+    valore[misura] = (pd.to_numeric(prestazioni[misura], errors='coerce') * 1000).round()
+    valore[multiple] = pd.to_numeric(prestazioni[multiple], errors='coerce')
+
+    stato = prestazioni.map(STATI_PRESTAZIONE).fillna(STATO_VALIDA)
+    stato[(stato == STATO_VALIDA) & valore.isna()] = STATI_PRESTAZIONE['boh']
+    valore[stato != STATO_VALIDA] = pd.NA
+
+    return pd.DataFrame({'Valore': valore.round().astype('Int64'),
+                         'Stato': stato.astype('int8')})
+
+
 def clean_nome(nome):
     
     nome = nome.replace('(I)','')
@@ -489,12 +774,107 @@ def clean_nome(nome):
     return nome
 
 
-def scrape_nuovo_corse(comptetition_row):
+def batterie_sigma_nuovo(html, acquisite=None):
+    """
+    Legge una pagina di risultati del sigma nuovo in un solo giro sul
+    documento e restituisce (generatore) le terne (titolo, dataora, tabella)
+    dove titolo è il testo della <div class='row'> con il titolo della
+    batteria (vedi titolo_batteria()), dataora il testo del suo ultimo <p>
+    (data e luogo) e tabella il DataFrame della tabella che la segue (vedi
+    tabella_html()). Senza lxml la pagina viene letta con BeautifulSoup.
+    Le prime 2 div della pagina e quelle con scritto risultati/results non
+    sono titoli di batterie. Le tabelle che non seguono un titolo (per
+    esempio quella dei record della disciplina), quelle vuote e i riepiloghi
+    (stessi risultati delle batterie) sono saltati.
+
+    acquisite è un dict {titolo: impronta} delle batterie già lette: quelle
+    con la tabella che non è cambiata (impronta_tabella()) vengono saltate
+    senza leggere la tabella. Le batterie restituite vengono aggiunte ad
+    acquisite.
+    """
+    if CON_LXML:
+        elementi = ((el.tag, el.get('class', '').split(), el)
+                    for el in albero_html(html).iter('div', 'table'))
+        paragrafi = lambda div: div.findall('.//p')
+    else:
+        elementi = ((el.name, el.get('class', []), el)
+                    for el in parse_html(html).find_all(['div', 'table']))
+        paragrafi = lambda div: div.find_all('p')
+
+    n_div = 0
+    titolo = None
+    for tag, classi, el in elementi:
+        if tag == 'div':
+            if 'row' not in classi:
+                continue
+            n_div += 1
+            testo = testo_html(el).lower()
+            if n_div <= 2 or ('risultati' in testo) or ('results' in testo):
+                continue
+            # la tabella dopo un riepilogo resta senza titolo e viene saltata
+            riepilogo = ('riepilogo' in testo) or ('summary' in testo)
+            titolo = None if riepilogo else el
+
+        elif titolo is not None:
+            chiave = titolo_batteria(titolo)
+            if acquisite is not None:
+                impronta = impronta_tabella(el)
+                if acquisite.get(chiave) == impronta:
+                    titolo = None
+                    continue
+
+            df = tabella_html(el)
+            if df is not None:
+                yield chiave, testo_html(paragrafi(titolo)[-1]), df
+                if acquisite is not None:
+                    acquisite[chiave] = impronta
+                titolo = None
+
+
+def titolo_batteria(div):
+    """Testo della div con il titolo di una batteria (spazi normalizzati)."""
+    return ' '.join(testo_html(div).split())
+
+
+# Colonne dei risultati restituiti da scrape_*_corse()
+COLONNE_RISULTATI = ['Disciplina', 'Prestazione', 'Atleta','Anno','Categoria','Società','Data','Luogo','Gara','Batteria']
+
+
+def raccogli_batterie(batterie):
+    """
+    Mette insieme in un solo DataFrame (un solo pd.concat) le batterie
+    restituite da uno dei generatori batterie_*_corse(). Se non ce ne sono
+    restituisce un DataFrame vuoto con COLONNE_RISULTATI.
+    """
+    batterie = list(batterie)
+    if not batterie:
+        return pd.DataFrame(columns=COLONNE_RISULTATI)
+    return pd.concat(batterie, ignore_index=True)
+
+
+def batterie_corse(competition_row):
+    """Chiama batterie_nuovo_corse() o batterie_vecchio_corse() in base a 'Versione Sigma'."""
+    if competition_row['Versione Sigma'] == 'Nuovo':
+        return batterie_nuovo_corse(competition_row)
+    return batterie_vecchio_corse(competition_row)
+
+
+def scrape_nuovo_corse(comptetition_row, acquisite=None):
+    ## Come batterie_nuovo_corse(), ma restituisce tutte le batterie in una DataFrame con columns=COLONNE_RISULTATI
+    return raccogli_batterie(batterie_nuovo_corse(comptetition_row, acquisite))
+
+
+def scrape_vecchio_corse(competition_row):
+    ## Come batterie_vecchio_corse(), ma restituisce tutte le batterie in una DataFrame con columns=COLONNE_RISULTATI
+    return raccogli_batterie(batterie_vecchio_corse(competition_row))
+
+
+def batterie_nuovo_corse(comptetition_row, acquisite=None):
     ## Funzione per fare scraping dei risultati delle corse (individuali), degli ostacoli e della marcia nel sito nuovo ('Versione Sigma' = 'Nuovo')
     ## input è una riga di un DataFrame con columns=['Codice','Versione Sigma','Warning','Disciplina','Nome','Link']
-    ## Se la versione del sigma in input non è corretta la funzione stampa un errore e non restituisce nulla
-    ## Se la disciplina non è corretta stampa un errore e restituisce un DataFrame vuoto
-    ## Restituisce una DataFrame con columns=['Disciplina', 'Prestazione', 'Atleta','Anno','Categoria','Società','Data','Luogo','Gara]
+    ## Generatore: restituisce una DataFrame per ogni batteria, con columns=COLONNE_RISULTATI
+    ## acquisite: dict {titolo: impronta} delle batterie già lette, che vengono saltate se non sono cambiate (vedi batterie_sigma_nuovo())
+    ## Se la versione del sigma o la disciplina in input non sono corrette la funzione stampa un errore e non restituisce nessuna batteria
     
     # Ogni tabella è preceduta da una <div class='row' con alcune informazioni(data, luodo, numero di batteria/finale/serie o se è un riepilogo)
     # devo ancora gestire le start list
@@ -506,91 +886,99 @@ def scrape_nuovo_corse(comptetition_row):
     
     url = comptetition_row['Link']
     disciplina = comptetition_row['Disciplina']
-    batterie = pd.DataFrame(columns=['Disciplina', 'Prestazione', 'Atleta','Anno','Categoria','Società','Data','Luogo','Gara'])
     
     # Controllo che sia una corsa individuale o la marcia
     if not(disciplina[0].isdigit() or disciplina.startswith('Marcia')) or 'x' in disciplina:
         print('Non compatibile con '+disciplina+'. Solo corse individuali e marcia.')
-        return batterie
+        return
     
-    # Recupero le linee di testo della pagina (titoli nomi delle batterie per la maggior parte)
-    r = requests.get(url).text
-    soup = BeautifulSoup(r, 'html.parser')
-    div_righe = soup.find_all('div', class_='row')
+    r = http_get_cache(url).text
 
-    div_batterie = []
-    for a in div_righe[2:]: # le prime 2 div sono di intestazione
-        if not(('risultati' in a.text.lower()) or ('results' in a.text.lower()) ): # anche le div con scritto risultati/results sono inutili
-            div_batterie.append(a)
+    for titolo, dataora, df in batterie_sigma_nuovo(r, acquisite):
+        if 'Atleta' in df: colonna_atleta = df.columns.get_loc('Atleta')
+        elif 'Athlete' in df: colonna_atleta = df.columns.get_loc('Athlete')
+        else: print('Non trovo la colonna atleta: ' + url)
 
+        batteria_N = df.iloc[:, colonna_atleta:colonna_atleta+5]
 
-    # Ora prendo tutte le tabelle che ci sono
-    dfs = pd.read_html(r)
-    if dfs[0].iloc[0,0] == 'Record': dfs = dfs[1:]  # a volte la prima tabella ha i record della disciplina
-    
-    if len(dfs) != len(div_batterie): # controllo se ho filtrato correttamente tabelle e titolo delle tabelle
-        print(url)
-        print('Ho trovato ' + str(len(div_batterie)) + ' div e ' + str(len(dfs)) + ' tabelle:')
-        
-    else:
-        for a,df in zip(div_batterie, dfs):
-            if not(('riepilogo' in a.text.lower()) or ('summary' in a.text.lower())): # la tabella con il riepilogo contiene gli stessi risultati delle altre (se c'è)
-                
-                if 'Atleta' in df: colonna_atleta = df.columns.get_loc('Atleta')
-                elif 'Athlete' in df: colonna_atleta = df.columns.get_loc('Athlete')
-                else: print('Non trovo la colonna atleta: ' + url)
-                
-                batteria_N = df.iloc[:, colonna_atleta:colonna_atleta+5]
-                
-                while batteria_N.iloc[-1,0] == batteria_N.iloc[-1,1]:   # le ultime righe hanno cose che non sono risultati. Vanno tolte e
-                    batteria_N = batteria_N.iloc[:-1,:]                 # sfrutto il fatto che sono la stessa cella ripetutta per tutta la riga
-                
-                (luogo_batteria, data_batteria) = luogo_data_batteria(a.find_all('p')[-1].text)
-                
-                batteria_N['Data'] = data_batteria
-                batteria_N['Luogo'] = luogo_batteria
-                batteria_N['Disciplina'] = disciplina
-                
-                batteria_N = batteria_N.iloc[:, [7, 4, 0, 1, 2, 3, 5, 6]]
-                batteria_N.columns = ['Disciplina', 'Prestazione', 'Atleta','Anno','Categoria','Società','Data','Luogo']
-                batteria_N['Gara'] = url
-                batteria_N['Prestazione'] = batteria_N['Prestazione'].apply(clean_tempo)
-                batteria_N['Atleta'] = batteria_N['Atleta'].apply(clean_nome)
+        while batteria_N.iloc[-1,0] == batteria_N.iloc[-1,1]:   # le ultime righe hanno cose che non sono risultati. Vanno tolte e
+            batteria_N = batteria_N.iloc[:-1,:]                 # sfrutto il fatto che sono la stessa cella ripetutta per tutta la riga
 
-                batterie = pd.concat([batterie, batteria_N]).reset_index(drop=True)
-    
-    return batterie
-            
+        (luogo_batteria, data_batteria) = luogo_data_batteria(dataora)
+
+        batteria_N['Data'] = data_batteria
+        batteria_N['Luogo'] = luogo_batteria
+        batteria_N['Disciplina'] = disciplina
+
+        batteria_N = batteria_N.iloc[:, [7, 4, 0, 1, 2, 3, 5, 6]]
+        batteria_N.columns = ['Disciplina', 'Prestazione', 'Atleta','Anno','Categoria','Società','Data','Luogo']
+        batteria_N['Gara'] = url
+        batteria_N['Batteria'] = titolo
+        batteria_N['Prestazione'] = batteria_N['Prestazione'].apply(clean_tempo)
+        batteria_N['Atleta'] = batteria_N['Atleta'].apply(clean_nome)
+
+        yield batteria_N
+
+
+def _classe(nome):
+    # XPath per "nome è una delle classi di @class" (come class_= di BeautifulSoup)
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {nome} ')"
 
-def scrape_vecchio_corse(competition_row):
-    ## Funzione per fare scraping dei risultati delle corse (individuali), degli ostacoli e della marcia nel sito nuovo ('Versione Sigma' = 'Nuovo')
-    ## input è una riga di un DataFrame con columns=['Codice','Versione Sigma','Warning','Disciplina','Nome','Link']
-    ## Se la versione del sigma in input non è corretta la funzione stampa un errore e non restituisce nulla
-    ## Se la disciplina non è corretta stampa un errore e restituisce un DataFrame vuoto
-    ## Restituisce una DataFrame con columns=['Disciplina', 'Prestazione', 'Atleta','Anno','Categoria','Società','Data','Luogo','Gara]
-    
-    # Controllo la versione del sigma
-    if competition_row['Versione Sigma'] != 'Vecchio':
-        print('Versione sigma '+competition_row['Versione Sigma']+'. Questa funzione funziona con il sigma nuovo')
-        return
-    
-    url = competition_row['Link']
-    disciplina = competition_row['Disciplina']
-    batterie = pd.DataFrame(columns=['Disciplina', 'Prestazione', 'Atleta','Anno','Categoria','Società','Data','Luogo','Gara'])
-    
-    # Controllo che sia una corsa individuale o la marcia
-    if not(disciplina[0].isdigit() or disciplina.startswith('Marcia')) or 'x' in disciplina:
-        print('Non compatibile con '+disciplina+'. Solo corse individuali e marcia.')
-        return batterie
-    
-    r = requests.get(url).text
-    soup = BeautifulSoup(r, 'html.parser')
+
+# Cella Atleta di ogni riga dei risultati del sigma vecchio, tutte con una
+# sola query sulla pagina. Le 4 celle dopo sono Anno, Categoria, Società,
+# Prestazione
+if CON_LXML:
+    _XP_ATLETI_VECCHIO = etree.XPath(
+        f"//tr[{_classe('due')} or {_classe('uno')}]/td[@id='t1_atle'][1]")
+    _XP_TITOLI_VECCHIO = etree.XPath(f"//td[{_classe('tab_turno_titolo')}]")
+    _XP_DATAORA_VECCHIO = etree.XPath(f"//td[{_classe('tab_turno_dataora')}]")
+
+
+def tabelle_sigma_vecchio(html):
+    """
+    Legge una pagina di risultati del sigma vecchio con lxml (solo con
+    CON_LXML) e restituisce
+    (titoli, dataora, tabelle): il testo delle celle tab_turno_titolo e
+    tab_turno_dataora e per ogni batteria la lista delle righe
+    [Atleta, Anno, Categoria, Società, Prestazione].
+    Le righe vengono raggruppate per la <table> che le contiene direttamente,
+    quindi non c'è la tabella con tutte le righe che si ha con html.parser.
+    Come in tabelle_sigma_vecchio_soup() una riga uguale alla precedente
+    della stessa tabella viene saltata.
+    """
+    albero = albero_html(html)
+
+    tabelle = {}
+    for cella in _XP_ATLETI_VECCHIO(albero):
+        tabella = next(cella.iterancestors('table'), None)
+        celle = [cella] + list(islice(cella.itersiblings('td'), 4))
+        data = [c.text_content().strip() for c in celle]
+        data += [''] * (5 - len(data))
+
+        tabella_N = tabelle.setdefault(tabella, [])
+        if not tabella_N or tabella_N[-1] != data:
+            tabella_N.append(data)
+
+    titoli = [td.text_content() for td in _XP_TITOLI_VECCHIO(albero)]
+    dataora = [td.text_content() for td in _XP_DATAORA_VECCHIO(albero)]
+
+    return titoli, dataora, list(tabelle.values())
+
+
+def tabelle_sigma_vecchio_soup(html, url):
+    """
+    Come tabelle_sigma_vecchio(), ma con BeautifulSoup e html.parser. Più
+    lenta, serve per le pagine dove l'HTML rotto viene riparato da lxml in
+    modo diverso.
+    """
+    soup = parse_html(html, veloce=False)
 
     # Ora posso cominciare a scaricare le tabelle della pagina
     
     soup_tabelle = soup.find_all('table')
 
-    dfs_risultati = []
+    tabelle = []
     if soup_tabelle:
         
         for soup_tab in soup_tabelle:
@@ -624,43 +1012,72 @@ def scrape_vecchio_corse(competition_row):
                         break
                     
             if tabella_N:
-                df_N = pd.DataFrame(tabella_N, columns=['Atleta','Anno','Categoria','Società','Prestazione'])
-                dfs_risultati.append(df_N)
+                tabelle.append(tabella_N)
         
     else: print('La pagina è senza tabelle '+url)
     
     # la prima tabella è una tabella con tutte le righe delle altre tabelle. Credo succeda per qualche errore di sitassi nel file html
-    dfs_risultati = dfs_risultati[1:]
+    tabelle = tabelle[1:]
     
     # Ora prendo i titoli delle batterie assieme alla riga dove c'è scritto data e ora
     
-    titoli = soup.find_all('td', class_='tab_turno_titolo')
-    dataora_tutti = soup.find_all('td', class_='tab_turno_dataora')
+    titoli = [td.text for td in soup.find_all('td', class_='tab_turno_titolo')]
+    dataora = [td.text for td in soup.find_all('td', class_='tab_turno_dataora')]
+
+    return titoli, dataora, tabelle
+
+
+def batterie_vecchio_corse(competition_row):
+    ## Funzione per fare scraping dei risultati delle corse (individuali), degli ostacoli e della marcia nel sito vecchio ('Versione Sigma' = 'Vecchio')
+    ## input è una riga di un DataFrame con columns=['Codice','Versione Sigma','Warning','Disciplina','Nome','Link']
+    ## Generatore: restituisce una DataFrame per ogni batteria, con columns=COLONNE_RISULTATI
+    ## Se la versione del sigma o la disciplina in input non sono corrette la funzione stampa un errore e non restituisce nessuna batteria
     
+    # Controllo la versione del sigma
+    if competition_row['Versione Sigma'] != 'Vecchio':
+        print('Versione sigma '+competition_row['Versione Sigma']+'. Questa funzione funziona con il sigma vecchio')
+        return
+    
+    url = competition_row['Link']
+    disciplina = competition_row['Disciplina']
+    
+    # Controllo che sia una corsa individuale o la marcia
+    if not(disciplina[0].isdigit() or disciplina.startswith('Marcia')) or 'x' in disciplina:
+        print('Non compatibile con '+disciplina+'. Solo corse individuali e marcia.')
+        return
+    
+    r = http_get_cache(url).text
+
+    # Prima la lettura veloce con lxml, se titoli e tabelle non tornano (o
+    # lxml non c'è) si rilegge la pagina con html.parser come si è sempre fatto
+    titoli, dataora_tutti, tabelle = tabelle_sigma_vecchio(r) if CON_LXML else ([], [], [])
+    if not tabelle or len(titoli) != len(tabelle):
+        titoli, dataora_tutti, tabelle = tabelle_sigma_vecchio_soup(r, url)
+
     # Se il titolo è 'riepilogo', allora quella dataora e quella tabella non mi interessano. In questo modo dovrei rimanere solo con batterie/serie/finali
     
-    if len(titoli) != len(dfs_risultati): # controllo se ho filtrato correttamente tabelle e titolo delle tabelle
+    if len(titoli) != len(tabelle): # controllo se ho filtrato correttamente tabelle e titolo delle tabelle
         print(url)
-        print('Ho trovato ' + str(len(titoli)) + ' titoli e ' + str(len(dfs_risultati)) + ' tabelle:')
+        print('Ho trovato ' + str(len(titoli)) + ' titoli e ' + str(len(tabelle)) + ' tabelle:')
         
     else:
-        for titolo, a, df in zip(titoli, dataora_tutti, dfs_risultati):
-            if not('riepilogo' in titolo.text.lower()):
+        for titolo, a, tabella_N in zip(titoli, dataora_tutti, tabelle):
+            if not('riepilogo' in titolo.lower()):
                 
+                df = pd.DataFrame(tabella_N, columns=['Atleta','Anno','Categoria','Società','Prestazione'])
                 batteria_N = df[df['Atleta'] != df['Prestazione']].copy()
                 
-                (luogo_batteria, data_batteria) = luogo_data_batteria(a.text)
+                (luogo_batteria, data_batteria) = luogo_data_batteria(a)
                 
                 batteria_N['Data'] = data_batteria
                 batteria_N['Luogo'] = luogo_batteria
                 batteria_N['Disciplina'] = disciplina
                 batteria_N['Gara'] = url
+                batteria_N['Batteria'] = ' '.join((titolo + ' ' + a).split())
                 
                 batteria_N['Prestazione'] = batteria_N['Prestazione'].apply(clean_tempo)
                 batteria_N['Atleta'] = batteria_N['Atleta'].apply(clean_nome)
 
-                batteria_N = batteria_N[['Disciplina','Prestazione','Atleta','Anno','Categoria','Società','Data','Luogo','Gara']]
+                batteria_N = batteria_N[COLONNE_RISULTATI]
 
-                batterie = pd.concat([batterie, batteria_N]).reset_index(drop=True)
-                
-    return batterie
+                yield batteria_N
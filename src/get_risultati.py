@@ -5,8 +5,10 @@ from func_scrape import *
 df_link = pd.read_csv('database_link/indoor_2025/link_risultati.csv')
 df_link = df_link[(df_link['Versione Sigma'] == 'Vecchio')]
 
+# Ogni batteria viene scritta nel csv appena letta, in memoria c'è al massimo
+# una batteria alla volta
 write_header = True
 for ii,row in df_link.iterrows():
-    df_temp = scrape_vecchio_corse(row)
-    df_temp.to_csv('TEST_vecchio2.csv', mode='a', index=False, header=write_header)
-    write_header = False
+    for batteria in batterie_corse(row):
+        batteria.to_csv('TEST_vecchio2.csv', mode='a', index=False, header=write_header)
+        write_header = False
@@ -1,9 +1,16 @@
 from func_general import update_gare_database, get_meet_info, get_events_link, get_db_engine, assegna_evento
+from func_http import stampa_statistiche_http, pulisci_cache_http
+from func_db import aggiorna_schema
 
 import time
 start_time = time.time()
 
 
+""" Aggiunge allo schema del database le colonne/tabelle che mancano """
+with get_db_engine().connect() as conn:
+    aggiorna_schema(conn)
+
+
 """ Cerca nuove fare nel calendario """
 print('\n---------------------------------------------')
 print("Scarico l'elenco delle gare dal calendario Fidal")
@@ -22,8 +29,9 @@ print('\n---------------------------------------------')
 print("Ottengo informazioni su ogni gara")
 
 update_condition = 'date_0' # routine update
+n_workers = 8 # gare classificate in parallelo
 with get_db_engine().connect() as conn:
-    get_meet_info(conn, update_condition)
+    get_meet_info(conn, update_condition, n_workers=n_workers)
 
 
 
@@ -74,6 +82,8 @@ with get_db_engine().connect() as conn:
     assegna_evento(conn, update_condition)
 
 
+stampa_statistiche_http()
+print(f"Tolti {pulisci_cache_http()} file vecchi dalla cache http")
 print("--- %s secondi ---" % round(time.time() - start_time, 2))
 
 
@@ -0,0 +1,38 @@
+from func_general import get_db_engine, riclassifica_pagine_gara, riclassifica_regole_cambiate
+from func_db import aggiorna_schema
+
+import time
+
+
+if __name__ == '__main__':
+    start_time = time.time()
+
+
+    """ Aggiunge allo schema del database le colonne/tabelle che mancano """
+    with get_db_engine().connect() as conn:
+        aggiorna_schema(conn)
+
+
+    """
+    Da lanciare dopo aver cambiato le regole con cui classifica_evento() (in
+    func_general) classifica un nome: assegna_evento_generale(),
+    assegna_evento_specifico(), info_ostacoli(), check_master(), chiave_evento()
+    e le tabelle che usano, cioè tutto quello che è elencato in GRUPPI_REGOLE.
+    Ogni riga di pagine_gara ricorda la versione delle regole con cui è stata
+    classificata: di norma vengono rifatte solo le righe toccate dai gruppi di
+    regole cambiati (GRUPPI_REGOLE). Con tutto = True si riclassificano invece
+    tutte le pagine dal 2011 a oggi.
+    """
+    print('\n---------------------------------------------')
+    print("Riclassifico le pagine delle gare")
+
+    tutto = False
+    righe_blocco = 20000 # righe lette dal database alla volta
+    if tutto:
+        riclassifica_pagine_gara(get_db_engine(), righe_blocco)
+    else:
+        with get_db_engine().connect() as conn:
+            riclassifica_regole_cambiate(conn)
+
+
+    print("--- %s secondi ---" % round(time.time() - start_time, 2))
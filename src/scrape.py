@@ -1,15 +1,22 @@
 from func_general import get_db_engine
-from func_scrape import get_iscritti, gare_in_DB
+from func_scrape import get_iscritti, get_risultati, gare_in_DB
+from func_db import aggiorna_schema
+from func_http import stampa_statistiche_http
 
 
 """ Scarichiamo tutti gli iscritti alle gare """
 update_condition = 'date_0'
 with get_db_engine().connect() as conn:
     get_iscritti(conn, update_condition)
+stampa_statistiche_http()
 
 
 """ Scarichiamo tutti i risultati alle gare """
-# NO
+update_condition = 'date_0'
+with get_db_engine().connect() as conn:
+    aggiorna_schema(conn)
+    get_risultati(conn, update_condition)
+stampa_statistiche_http()
 
 
 """